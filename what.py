@@ -53,6 +53,100 @@ In each of the switches that take a <date>, it may be any of:
 -y, -1y, -year  set the end date to a year after "today"
 -2y             ditto for 2 years
 
+-where <expr>   only report events matching <expr>, which combines
+                any of:
+
+                    @<word>         events with that @<word>
+                    /<regex>/       events whose text matches <regex>
+                    day=<day>,...   events on those days of the week
+                    month=<mon>,... events in those months
+                    kind=<kind>,... events repeating that way, one of
+                                    once, yearly, easter, every, monthly
+                                    or ordinal
+
+                with & (and), | (or), ~ (not) and parentheses. For
+                instance:
+
+                    -where '@alfred & ~/lesson/ & day=Sat,Sun'
+
+                This works with the normal report (including with -jobs),
+                and with -count, -conflicts, -free, -stats, -diff,
+                -since-last, -export, -next and -days. Giving it with any
+                other switch is an error.
+
+-conflicts      report the events that overlap in time, for each @<word>
+                (or just for the @<words> given). Events only have a time
+                if their text contains <hh>:<mm> (taken to last an hour)
+                or <hh>:<mm>..<hh>:<mm>.
+
+-free           report the times, within working hours on Monday to
+                Friday, when none of the @<words> given is busy. An event
+                with a time is busy for that time (or an hour, if it just
+                gives a start time), and one without is busy all day.
+
+-hours <hh>:<mm>..<hh>:<mm>
+                the working hours for -free. The default is 9:00..17:00.
+
+-stats [json]   report statistics about the events in the date range:
+                how many there are each month and each week, the busiest
+                days, and how many there are for each @<word> and each
+                kind of repetition. If 'json' is given, write them out as
+                JSON instead. Any @<words> or -where given restrict which
+                events are counted.
+
+-diff <old> <new>
+                report which events, within the date range, were removed or
+                added between two versions of an events file, as lines
+                starting with '-' or '+'. Only the events that differ between
+                the files have their dates worked out.
+
+-since-last     only report the events (for the @<words> given, if any)
+                that have not been reported by -since-last before, or have
+                changed since. What has been reported is remembered in a
+                file called <filename>.seen, which forgets days as they pass.
+
+-export-sqlite <db> [<months>]
+                write the events, and their occurrences from a month ago
+                until <months> (default 18) from now, to the SQLite
+                database <db>, in tables 'events', 'event_words' and
+                'occurrences'. If <db> already exists, only the events that
+                have changed are rewritten.
+
+-store <db>     write the events to <db>, an SQLite event store, replacing
+                whatever was there. If the events file is itself an event
+                store, this copies it. The name of <db> must end with .db,
+                .sqlite or .sqlite3, and any such file may then be used
+                instead of a text file. For instance:
+
+                    what.py what.txt -store what.db
+                    what.py what.db -m
+                    what.py what.db -tidy > what.txt
+
+                An event store is quicker to read for a large calendar,
+                since only the events that might occur within the dates
+                being reported on are read. Events whose dates depend on
+                when they are read (':first Sat', ':easter' and so on)
+                have those dates worked out afresh each time.
+
+-summary        report each event just once, with how it repeats, the
+                first and last dates it occurs on in the date range, and
+                how many times it occurs there (and how many times it
+                would have, but for ':except'). This is much shorter (and
+                quicker) than the normal report for a long date range.
+
+-export <file> [<n>]
+                write each event in the date range to <file> (or, if <file>
+                is '-', to standard output), one per line, as
+                <yyyy-mm-dd><tab><text>, in order. Any @<words> or -where
+                given restrict which events are written. At most <n>
+                (default 200000) events are held in memory at once, with
+                the rest sorted into temporary files, so even a very long
+                date range can be written out.
+
+-next <n>       report the next <n> events, starting with "today", however
+                far ahead they may be. This may be combined with @<words>,
+                to report (for instance) the next 3 @pubhol events.
+
 -christmas      report on the month around Christmas (of this year)
 -xmas           the same
 -easter         report on the month around Easter, of this year or of next
@@ -72,6 +166,19 @@ In each of the switches that take a <date>, it may be any of:
                 either @work and/or @holiday in their text will be reported).
                 (But see -count, which changes how the @<words> are used.)
 
+-days <expr>    report the days on which a combination of @<words> occur.
+                <expr> combines @<words> with & (and), | (or) and ~ (not),
+                and parentheses, so for instance:
+
+                    -days '@alfred & @bethany'
+
+                reports the days when both @alfred and @bethany have
+                something on, and:
+
+                    -days '@pubhol & ~@work'
+
+                the public holidays when there is nothing at @work.
+
 -count          for the @<words> specified, count how many events contain
                 them, and report that for each @<word>. This counts the
                 @<words> in the final list of events, so if we have:
@@ -98,6 +205,9 @@ In each of the switches that take a <date>, it may be any of:
 -nobold         Don't try to enbolden the current date. Useful if piping
                 to a file.
 -noweek         Don't put the week number at the start of each event line.
+-jobs <n>       Work out the events using <n> processes at once. This is only
+                worth doing for very long date ranges or very large event
+                files.
 
 -atwords        report on which @<words> are used in the events file.
 -at_words       synonym for -atwords
@@ -111,6 +221,15 @@ In each of the switches that take a <date>, it may be any of:
 -repr           output the event data with annotations - this is intended
                 for debugging the interpretation of said data. Again, the
                 default start date will be 01-01-1900.
+-index [<n>]    write a day index for the events file, covering the month
+                before "today" and the <n> months after it (18 if <n> is not
+                given). The index is written next to the events file, with
+                ".index" added to its name. Whilst the events file has not
+                changed, reports whose dates are all within that range are
+                then read straight from the index, which is quicker. Events
+                whose dates depend on when they are read (':first Sat',
+                ':every Thu' and so on) are still read afresh each time.
+-noindex        Don't use the day index, even if there is one.
 -doctest        run the internal doctests
 """
 
@@ -250,6 +369,9 @@ it matches). A continuation line must start with a <colon-word>.The
 * :except <date>, <reason>] -- the preceding event does not occur on this
   particular day. This is the only colon word to take a ", <text>" after its
   date. At the moment, that text (<reason>) is just discarded.
+* :except <date> .. <date>[, <reason>] -- the preceding event does not occur
+  on any of the days in that range (including both of the given dates). This
+  is useful for school holidays, and the like.
 * :from <date> -- the preceding event starts repetition on or after this date.
   This is intended for use with dates such as ':every Tue' - it makes no sense
   to use it with a <date> that already has an explicit day/month/year.
@@ -278,8 +400,15 @@ it matches). A continuation line must start with a <colon-word>.The
 * :for <count> weekdays -- for that many Mon..Fri days. Note that if the
   original date is a Sat or Sun, it will have already been added as an event
   - this only affects dates *after* that. It works exactly as if it were a
-  combination of an appropriate ':until <date>' with the internal weekend
-  days excluded using ':except <weekend-day>'.
+  combination of an appropriate ':until <date>' with ':weekdays'.
+* :for <count> workdays @<word> -- for that many working days, where the
+  working days are Mon..Fri, except for the dates of any events containing
+  @<word> (so, for instance, ':for 10 workdays @pubhol'). It works as if it
+  were a combination of ':for <count> weekdays' with an appropriate
+  ':except' for each of those holidays.
+* :weekdays -- the preceding event only repeats on Mon..Fri. As with
+  ':for <count> weekdays', the original date is kept even if it is a Sat or
+  Sun.
 
 Note that it is not defined what happens if you specify contradictory or
 clashing conditions - for instance saying ':until <some-date>' and then
@@ -384,8 +513,17 @@ this program myself was more fun...
 # -----------------------------------------------------------------------------
 # At last, some code
 
+import array
+import bisect
 import calendar
+import collections
 import datetime
+import hashlib
+import heapq
+import io
+import itertools
+import json
+import multiprocessing
 import os
 import platform
 import re
@@ -393,6 +531,8 @@ import shlex
 import struct
 import subprocess
 import sys
+import tempfile
+import threading
 
 from functools import total_ordering
 
@@ -408,6 +548,19 @@ ORDINAL = {1: 'first', 2:'second', 3:'third', 4:'fourth', 5:'fifth',
            -1:'last', -2:'lastbutone'}
 
 timespan_re = re.compile(r'(\d|\d\d):(\d\d)\.\.(\d|\d\d):(\d\d)')
+time_re = re.compile(r'(?:^|(?<=\W))(\d|\d\d):(\d\d)(?!\w|:\d)')
+
+# How long we assume an event lasts if it only gives a start time
+DEFAULT_EVENT_MINUTES = 60
+
+MINUTES_PER_DAY = 24*60
+
+# A weekday mask for Mon..Fri (see Event.weekday_mask)
+WEEKDAYS_MASK = 0x1F
+
+# How many dates Event.next_date (or previous_date) will try and reject
+# before deciding that the event never occurs again
+MAX_SKIPPED_DATES = 1000
 
 ONE_DAY = datetime.timedelta(days=1)
 ONE_FORTNIGHT = datetime.timedelta(days=14)
@@ -543,6 +696,9 @@ def calc_ordinal_day(start, ordinal, day_name):
         three_weeks_after_start = start.replace(day=1+7+7+7)
         date = day_after_date(three_weeks_after_start, day_name, True)
     elif ordinal == 5:
+        first_weekday, month_len = calendar.monthrange(start.year, start.month)
+        if month_len < 1+7+7+7+7:
+            return None
         four_weeks_after_start = start.replace(day=1+7+7+7+7)
         date = day_after_date(four_weeks_after_start, day_name, True)
         if date.month != start.month:
@@ -554,10 +710,73 @@ def calc_ordinal_day(start, ordinal, day_name):
     elif ordinal == -2:
         first_weekday, month_len = calendar.monthrange(start.year, start.month)
         a_week_before_end = start.replace(day=month_len-7)
+        date = day_before_date(a_week_before_end, day_name, True)
     else:
         raise GiveUp('Ordinal index {} is not supported'.format(ordinal))
     return date
 
+def add_weekdays(date, count):
+    """Return the date 'count' weekdays (Mon..Fri) after 'date'.
+
+    If 'count' is 0 (or less), just returns 'date'.
+
+        >>> fri = datetime.date(2013, 11, 22)
+        >>> print(add_weekdays(fri, 1))
+        2013-11-25
+        >>> print(add_weekdays(fri, 5))
+        2013-11-29
+        >>> print(add_weekdays(fri + ONE_DAY, 1))
+        2013-11-25
+    """
+    if count <= 0:
+        return date
+    weekday = date.weekday()
+    if weekday > 4:
+        # Counting from a weekend is the same as counting from the Friday
+        date = date - datetime.timedelta(days=weekday-4)
+        weekday = 4
+    weeks, rest = divmod(count, 5)
+    days = weeks*7 + rest
+    if weekday + rest > 4:
+        # Skip over a weekend
+        days += 2
+    return date + datetime.timedelta(days=days)
+
+def count_weekdays(start, end, mask=WEEKDAYS_MASK):
+    """Count the days from 'start' to 'end' whose weekday is in 'mask'.
+
+    'mask' has bit 0 for Monday through to bit 6 for Sunday.
+
+        >>> count_weekdays(datetime.date(2013, 11, 1), datetime.date(2013, 11, 30))
+        21
+    """
+    days = (end - start).days + 1
+    if days <= 0:
+        return 0
+    weeks, rest = divmod(days, 7)
+    count = weeks * bin(mask & 0x7F).count('1')
+    weekday = start.weekday()
+    for offset in range(rest):
+        if (mask >> ((weekday + offset) % 7)) & 1:
+            count += 1
+    return count
+
+def _next_month(year, month):
+    """Return the (year, month) after the given one.
+    """
+    if month < 12:
+        return year, month+1
+    else:
+        return year+1, 1
+
+def _previous_month(year, month):
+    """Return the (year, month) before the given one.
+    """
+    if month > 1:
+        return year, month-1
+    else:
+        return year-1, 12
+
 def parse_year_month_day(text):
     """Given a text containing an actual date, turn it into a datetime date.
 
@@ -668,6 +887,258 @@ def parse_year_month_day(text):
 
     return date, yearly
 
+def format_date(date):
+    """Return a date in the form we read it, <year> <mon> <day> <nam>
+    """
+    return '{} {} {} {}'.format(date.year, MONTH_NAME[date.month], date.day,
+                                DAYS[date.weekday()])
+
+def _minutes(hours, minutes):
+    hours, minutes = int(hours), int(minutes)
+    if hours > 24 or minutes > 59 or (hours == 24 and minutes):
+        return None
+    return 60*hours + minutes
+
+def parse_time_span(text):
+    """Return the (start, end) minutes after midnight given in 'text'.
+
+    Returns None if 'text' does not give a time. A time on its own is
+    taken to last DEFAULT_EVENT_MINUTES, and a time span that ends before
+    it starts is taken to go past midnight.
+
+        >>> parse_time_span('17:00 @Charles Singing lesson')
+        (1020, 1080)
+        >>> parse_time_span('10:00..17:00, Newmarket Craft Fair')
+        (600, 1020)
+        >>> parse_time_span('22:00..1:30 Night shift')
+        (1320, 1530)
+        >>> print(parse_time_span('Tibs is :age, born in :year'))
+        None
+    """
+    match = timespan_re.search(text)
+    if match:
+        start = _minutes(match.group(1), match.group(2))
+        end = _minutes(match.group(3), match.group(4))
+        if start is not None and end is not None:
+            if end < start:
+                end += MINUTES_PER_DAY
+            return (start, end)
+    match = time_re.search(text)
+    if match:
+        start = _minutes(match.group(1), match.group(2))
+        if start is not None:
+            return (start, start + DEFAULT_EVENT_MINUTES)
+    return None
+
+def format_time_span(span):
+    """Return a (start, end) minutes span as <hh>:<mm>..<hh>:<mm>
+    """
+    start, end = span
+    return '{}:{:02}..{}:{:02}'.format(start//60, start%60,
+                                       (end//60)%24, end%60)
+
+class Exclusions(object):
+    """The dates (or ranges of dates) on which an event does not occur.
+
+    Each exclusion is kept as a (first, last, reason) tuple, where 'first'
+    and 'last' are day ordinals (a single date just has 'first' equal to
+    'last'), and the exclusions are kept sorted, so that we can find those
+    that matter for a range of dates without looking at all the rest.
+
+        >>> not_on = Exclusions()
+        >>> not_on.add(datetime.date(2013, 12, 23), datetime.date(2014, 1, 3),
+        ...            'Christmas holidays')
+        >>> not_on.add(datetime.date(2013, 10, 3))
+        >>> datetime.date(2013, 12, 25) in not_on
+        True
+        >>> datetime.date(2013, 12, 22) in not_on
+        False
+        >>> for first, last, reason in not_on.within(datetime.date(2013, 11, 1),
+        ...                                          datetime.date(2013, 12, 31)):
+        ...     print(first, last, reason)
+        2013-12-23 2014-01-03 Christmas holidays
+    """
+
+    def __init__(self):
+        self._entries = []
+        # The first ordinal of each entry, for bisecting
+        self._firsts = []
+        # The largest last ordinal of this and all earlier entries, which
+        # (unlike the last ordinals themselves) is sorted, so we can bisect
+        # on it as well
+        self._max_lasts = []
+        self._sorted = True
+        self._frozen = False
+
+    def add(self, first, last=None, reason=''):
+        """Add an exclusion, from date 'first' to date 'last' (inclusive).
+
+        If 'last' is not given, the exclusion is just for 'first'.
+        """
+        if self._frozen:
+            raise AttributeError('Cannot add to frozen Exclusions')
+        if last is None:
+            last = first
+        self._entries.append((first.toordinal(), last.toordinal(), reason))
+        self._sorted = False
+
+    def _sort(self):
+        if self._sorted:
+            return
+        self._entries = sorted(set(self._entries))
+        self._firsts = [first for first, last, reason in self._entries]
+        self._max_lasts = []
+        max_last = None
+        for first, last, reason in self._entries:
+            if max_last is None or last > max_last:
+                max_last = last
+            self._max_lasts.append(max_last)
+        self._sorted = True
+
+    def freeze(self):
+        """Stop any more exclusions being added.
+        """
+        self._sort()
+        self._frozen = True
+
+    def __len__(self):
+        self._sort()
+        return len(self._entries)
+
+    def __bool__(self):
+        return bool(self._entries)
+
+    __nonzero__ = __bool__
+
+    def __iter__(self):
+        """Yield (first, last, reason) tuples, with dates, in order.
+        """
+        self._sort()
+        for first, last, reason in self._entries:
+            yield (datetime.date.fromordinal(first),
+                   datetime.date.fromordinal(last), reason)
+
+    def _within(self, start_ordinal, end_ordinal):
+        """Yield those (ordinal) entries that overlap the given range.
+        """
+        self._sort()
+        # Entries before 'low' all end before the range starts, and those
+        # from 'high' onwards all start after it ends
+        low = bisect.bisect_left(self._max_lasts, start_ordinal)
+        high = bisect.bisect_right(self._firsts, end_ordinal)
+        for index in range(low, high):
+            first, last, reason = self._entries[index]
+            if last >= start_ordinal:
+                yield first, last, reason
+
+    def within(self, start, end):
+        """Yield (first, last, reason) for the exclusions that overlap start..end.
+        """
+        for first, last, reason in self._within(start.toordinal(),
+                                                end.toordinal()):
+            yield (datetime.date.fromordinal(first),
+                   datetime.date.fromordinal(last), reason)
+
+    def ranges_within(self, start, end):
+        """Return the excluded parts of start..end, as (first, last) dates.
+
+        Overlapping exclusions are merged, and each range is clipped to
+        start..end, so the ranges returned are sorted and do not overlap.
+        """
+        start_ordinal = start.toordinal()
+        end_ordinal = end.toordinal()
+        merged = []
+        for first, last, reason in self._within(start_ordinal, end_ordinal):
+            first = max(first, start_ordinal)
+            last = min(last, end_ordinal)
+            if merged and first <= merged[-1][1] + 1:
+                if last > merged[-1][1]:
+                    merged[-1][1] = last
+            else:
+                merged.append([first, last])
+        return [(datetime.date.fromordinal(first),
+                 datetime.date.fromordinal(last)) for first, last in merged]
+
+    def __contains__(self, date):
+        ordinal = date.toordinal()
+        for entry in self._within(ordinal, ordinal):
+            return True
+        return False
+
+    def excluded_run(self, date):
+        """Return the (first, last) dates of the excluded run around 'date'.
+
+        Touching or overlapping exclusions count as a single run. Returns
+        None if 'date' is not excluded.
+
+            >>> not_on = Exclusions()
+            >>> not_on.add(datetime.date(2013, 12, 23), datetime.date(2013, 12, 27))
+            >>> not_on.add(datetime.date(2013, 12, 28), datetime.date(2014, 1, 3))
+            >>> not_on.add(datetime.date(2013, 12, 20))
+            >>> first, last = not_on.excluded_run(datetime.date(2013, 12, 25))
+            >>> print(first, last)
+            2013-12-23 2014-01-03
+            >>> print(not_on.excluded_run(datetime.date(2013, 12, 21)))
+            None
+        """
+        ordinal = date.toordinal()
+        first = last = None
+        for entry_first, entry_last, reason in self._within(ordinal, ordinal):
+            if first is None or entry_first < first:
+                first = entry_first
+            if last is None or entry_last > last:
+                last = entry_last
+        if first is None:
+            return None
+        # Keep going while the next (or previous) day is also excluded
+        while True:
+            later = [entry_last for entry_first, entry_last, reason
+                     in self._within(last+1, last+1)]
+            if not later:
+                break
+            last = max(later)
+        while True:
+            earlier = [entry_first for entry_first, entry_last, reason
+                       in self._within(first-1, first-1)]
+            if not earlier:
+                break
+            first = min(earlier)
+        return (datetime.date.fromordinal(first),
+                datetime.date.fromordinal(last))
+
+    def remove_from(self, dates):
+        """Given a sorted list of dates, return those that are not excluded.
+        """
+        if not dates or not self._entries:
+            return dates
+        ranges = self.ranges_within(dates[0], dates[-1])
+        if not ranges:
+            return dates
+        result = []
+        index = 0
+        for date in dates:
+            while index < len(ranges) and ranges[index][1] < date:
+                index += 1
+            if index < len(ranges) and ranges[index][0] <= date:
+                continue
+            result.append(date)
+        return result
+
+    def condition_lines(self):
+        """Return our ':except' lines, as they would be written in a file.
+        """
+        lines = []
+        for first, last, reason in self:
+            if first == last:
+                when = format_date(first)
+            else:
+                when = '{} .. {}'.format(format_date(first), format_date(last))
+            if reason:
+                lines.append('  :except {}, {}'.format(when, reason))
+            else:
+                lines.append('  :except {}'.format(when))
+        return lines
+
 @total_ordering
 class Event(object):
     """A representation of an event.
@@ -711,11 +1182,34 @@ class Event(object):
         # Wednesday of the month
         self.repeat_ordinal = set()
 
-        # Do not occur on the specified dates. We don't particularly care
-        # if a date is a date we wouldn't have occurred on anyway...
-        # Stored as tuples of the form (<date>, <reason-text>) or
-        # (<date>, '') if there was no reason given
-        self.not_on = set()
+        # From ':for <count> workdays @<word>', a tuple of (<count>, @<word>).
+        # Once all the events have been read, this is turned into the
+        # appropriate conditions by resolve_workdays(), and set back to None.
+        self.for_workdays = None
+
+        # Only repeat on particular days of the week. If this is not None,
+        # then it is a bit mask, with bit 0 for Monday through to bit 6 for
+        # Sunday. Our own date is always kept, whatever day it is.
+        self.weekday_mask = None
+
+        # Do not occur on the specified dates (or ranges of dates). We don't
+        # particularly care if a date is a date we wouldn't have occurred on
+        # anyway... Each has a <reason-text>, which is '' if there was no
+        # reason given
+        self.not_on = Exclusions()
+
+        # The first line of the event, as the user wrote it, if we know it
+        self.source = None
+
+        # All of the lines of the event (with their indentation removed), as
+        # the user wrote them, if we know them, so that we can be read again
+        # with a different 'start'
+        self.source_lines = None
+
+        # True if any of our dates were given as colon dates (':first Sat',
+        # ':easter', and so on), which depend on the 'start' date that we
+        # were read with
+        self.anchored = False
 
     @property
     def text(self):
@@ -744,6 +1238,7 @@ class Event(object):
             [':age', ':year']
         """
         self._text = value
+        self.time_span = parse_time_span(value)
 
         # Is there anything interesting in the text...
         self.at_words = set([x.lower() for x in re.findall(at_word_re, value)])
@@ -796,15 +1291,11 @@ class Event(object):
             parts.append('  :until {} {} {}'.format(self.repeat_until.year,
                 MONTH_NAME[self.repeat_until.month], self.repeat_until.day))
 
+        if self.weekday_mask == WEEKDAYS_MASK:
+            parts.append('  :weekdays')
+
         if self.not_on:
-            for date, reason in sorted(self.not_on):
-                if reason:
-                    parts.append('  :except {} {} {} {}, {}'.format(date.year,
-                        MONTH_NAME[date.month], date.day, DAYS[date.weekday()],
-                        reason))
-                else:
-                    parts.append('  :except {} {} {} {}'.format(date.year,
-                        MONTH_NAME[date.month], date.day, DAYS[date.weekday()]))
+            parts.extend(self.not_on.condition_lines())
 
         return '\n'.join(parts)
 
@@ -846,15 +1337,11 @@ class Event(object):
             parts.append('  :until {} {} {}'.format(self.repeat_until.year,
                 MONTH_NAME[self.repeat_until.month], self.repeat_until.day))
 
+        if self.weekday_mask == WEEKDAYS_MASK:
+            parts.append('  :weekdays')
+
         if self.not_on:
-            for date, reason in sorted(self.not_on):
-                if reason:
-                    parts.append('  :except {} {} {} {}, {}'.format(date.year,
-                        MONTH_NAME[date.month], date.day, DAYS[date.weekday()],
-                        reason))
-                else:
-                    parts.append('  :except {} {} {} {}'.format(date.year,
-                        MONTH_NAME[date.month], date.day, DAYS[date.weekday()]))
+            parts.extend(self.not_on.condition_lines())
 
         if self.at_words:
             parts.append('  <at-words> {}'.format(', '.join(sorted(self.at_words))))
@@ -864,12 +1351,91 @@ class Event(object):
 
         return '\n'.join(parts)
 
-    def __hash__(self):
+    def __setattr__(self, name, value):
+        if getattr(self, '_frozen', False):
+            raise AttributeError('Cannot set {!r} on a frozen Event'.format(name))
+        object.__setattr__(self, name, value)
+
+    def repeats(self):
+        """Return True if we have been told how often to repeat.
+        """
+        return bool(self.repeat_yearly or self.repeat_every_N_days or
+                    self.repeat_on_Nth_of_month or self.repeat_ordinal)
+
+    def rule_weekdays(self):
+        """Return a mask of the days of the week our rules can give.
+
+        As with 'weekday_mask', bit 0 is Monday and bit 6 is Sunday. Our own
+        date is not counted, since it is kept whatever day of the week it is.
+
+            >>> e = Event(datetime.date(2013, 10, 5))
+            >>> e.repeat_ordinal.add((1, 'Sat'))
+            >>> bin(e.rule_weekdays())
+            '0b100000'
+            >>> e.repeat_every_N_days.add(14)
+            >>> bin(e.rule_weekdays())
+            '0b100000'
+            >>> e.repeat_on_Nth_of_month.add(5)
+            >>> bin(e.rule_weekdays())
+            '0b1111111'
+        """
+        mask = 0
+        if self.repeat_yearly:
+            if self.on_Nth_day_of_easter is not None:
+                # Easter Day is always a Sunday
+                mask |= 1 << ((6 + self.on_Nth_day_of_easter) % 7)
+            else:
+                mask |= 0x7F
+        for n in self.repeat_every_N_days:
+            if n % 7 == 0:
+                mask |= 1 << self.date.weekday()
+            else:
+                mask |= 0x7F
+        if self.repeat_on_Nth_of_month:
+            mask |= 0x7F
+        for index, day_name in self.repeat_ordinal:
+            mask |= 1 << DAYS.index(day_name)
+        return mask
+
+    def freeze(self):
+        """Make this event immutable.
+
+        Once all of its conditions have been read, an event should not change,
+        which means it can safely be shared (between threads, or between
+        calendars). Freezing also means we only need to work out our (rather
+        expensive) hash once.
+
+            >>> e = Event(datetime.date(2013, 10, 3))
+            >>> e.text = 'Something'
+            >>> e.freeze()
+            >>> e.repeat_yearly = True
+            Traceback (most recent call last):
+            ...
+            AttributeError: Cannot set 'repeat_yearly' on a frozen Event
+        """
+        if getattr(self, '_frozen', False):
+            return
+        self.repeat_every_N_days = frozenset(self.repeat_every_N_days)
+        self.repeat_on_Nth_of_month = frozenset(self.repeat_on_Nth_of_month)
+        self.repeat_ordinal = frozenset(self.repeat_ordinal)
+        self.not_on.freeze()
+        self.at_words = frozenset(self.at_words)
+        self.colon_words = frozenset(self.colon_words)
+        self._hash = self._calc_hash()
+        self._signature = rule_signature(self)
+        self._frozen = True
+
+    def _calc_hash(self):
         """A terribly simple and quite inefficient hash of ourselves.
         """
         parts = str(self).split('\n')
         return hash(' '.join(parts))
 
+    def __hash__(self):
+        if getattr(self, '_frozen', False):
+            return self._hash
+        return self._calc_hash()
+
     def __eq__(self, other):
         if self.date != other.date:
             return False
@@ -895,129 +1461,551 @@ class Event(object):
         the empty list if there are no occurrences in the given range. Note
         that we need to include the text because it may have been altered from
         the event.text
-        """
-        # Maybe sanity check our conditions lazily, at this point...
-        # ...or maybe not
 
+        This does not alter the event in any way, so it is safe to call it
+        for the same event from more than one thread at once.
+        """
         # If the caller asked for only texts that have particular at-words
         # within them, then we should/can check that first
         if at_words and not at_words.intersection(self.at_words):
             # OK, we don't match
             return []
 
-        dates = set()
+        return [(date, self.text_for(date), self)
+                for date in self.occurrence_dates(start, end)]
 
+    def occurrence_dates(self, start, end):
+        """Return a sorted list of the dates on which we occur.
+
+        Only dates from 'start' to 'end' (inclusive) are returned.
+
+            >>> e = Event(datetime.date(2013, 10, 3))
+            >>> e.repeat_every_N_days.add(7)
+            >>> e.repeat_until = datetime.date(2013, 10, 24)
+            >>> for date in e.occurrence_dates(datetime.date(2013, 10, 5),
+            ...                                datetime.date(2013, 12, 1)):
+            ...     print(date)
+            2013-10-10
+            2013-10-17
+            2013-10-24
+        """
         if self.repeat_from:
             if self.repeat_from > end:
-                #print(self)
-                #print('repeat from {} is after end {}'
-                #      ' - we can ignore it'.format(self.repeat_from, end))
                 return []
             if self.repeat_from > start:
-                #print(self)
-                #print('repeat from {} is after start {}'
-                #      ' - adjusting range'.format(self.repeat_from, start))
                 start = self.repeat_from
 
         if self.repeat_until:
             if self.repeat_until < start:
-                #print(self)
-                #print('repeat until {} is before start {}'
-                #      ' - we can ignore it'.format(self.repeat_until, start))
                 return []
             elif self.repeat_until < end:
-                #print(self)
-                #print('repeat until {} is before end {}'
-                #      ' - adjusting range'.format(self.repeat_until, end))
                 end = self.repeat_until
 
-            if not (self.repeat_yearly or self.repeat_every_N_days or
-                    self.repeat_on_Nth_of_month or self.repeat_ordinal):
-                # Hah, they didn't say how often to repeat "until".
-                # So let's assume daily...
-                self.repeat_every_N_days.add(1)
+        if start > end:
+            return []
+
+        return self.not_on.remove_from(self._candidate_dates(start, end))
+
+    def _candidate_dates(self, start, end):
+        """Return a sorted list of our dates from 'start' to 'end', ignoring ':except'.
+
+        'start' and 'end' should already take ':from' and ':until' into account.
+        """
+        dates = set()
 
         if start <= self.date <= end:
             dates.add(self.date)
 
         if self.repeat_yearly:
-            if self.on_Nth_day_of_easter:
-                # Remember, this date is already the Easter for start.year
-                for year in range(start.year+1, end.year+1):
-                    easter = calc_easter(year)
-                    d = easter + datetime.timedelta(days=self.on_Nth_day_of_easter)
+            if self.on_Nth_day_of_easter is not None:
+                offset = datetime.timedelta(days=self.on_Nth_day_of_easter)
+                for year in range(start.year, end.year+1):
+                    d = calc_easter(year) + offset
                     if start <= d <= end:
                         dates.add(d)
-                    if d > end:
-                        break
             else:
-                d = self.date.replace(year=start.year)
-                while d <= end:
-                    if d >= start:
+                for year in range(start.year, end.year+1):
+                    try:
+                        d = self.date.replace(year=year)
+                    except ValueError:
+                        # Feb 29 doesn't happen this year
+                        continue
+                    if start <= d <= end:
                         dates.add(d)
-                    d = d.replace(year=d.year+1)
 
         if self.repeat_every_N_days:
-            for n in sorted(self.repeat_every_N_days):
-                dt = datetime.timedelta(days=n)
-                d = self.date + dt
-                while d <= end:
-                    if d >= start:
-                        dates.add(d)
-                    d = d + dt
+            for n in self.repeat_every_N_days:
+                # Jump straight to the first repeat on or after 'start',
+                # rather than stepping all the way from our original date
+                steps = max(1, -(-(start - self.date).days // n))
+                ordinal = self.date.toordinal() + steps*n
+                last = end.toordinal()
+                while ordinal <= last:
+                    dates.add(datetime.date.fromordinal(ordinal))
+                    ordinal += n
 
-        # XXX This needs testing
         if self.repeat_on_Nth_of_month:
-            for n in sorted(self.repeat_on_Nth_of_month):
-                d = self.date
-                while True:
-                    if d.month < 12:
-                        d = d.replace(month=d.month+1)
-                    else:
-                        d = d.replace(month=1, year=d.year+1)
-                    if d > end:
-                        break
-                    if d >= start:
-                        dates.add(d)
+            for n in self.repeat_on_Nth_of_month:
+                # Repetitions start with the month after our original date
+                year, month = _next_month(self.date.year, self.date.month)
+                if (year, month) < (start.year, start.month):
+                    year, month = start.year, start.month
+                while (year, month) <= (end.year, end.month):
+                    if n <= calendar.monthrange(year, month)[1]:
+                        d = datetime.date(year, month, n)
+                        if start <= d <= end:
+                            dates.add(d)
+                    year, month = _next_month(year, month)
 
         if self.repeat_ordinal:
-            for index, day_name in sorted(self.repeat_ordinal):
-                this = self.date
+            for index, day_name in self.repeat_ordinal:
+                this = max(self.date, start).replace(day=1)
                 while True:
                     d = calc_ordinal_day(this, index, day_name)
-                    if d > end:
+                    if d is not None:
+                        if d > end:
+                            break
+                        if d >= start:
+                            dates.add(d)
+                    elif this > end:
                         break
-                    if d >= start:
-                        dates.add(d)
                     # And look to the next month
-                    if this.month < 12:
-                        this = this.replace(month=this.month+1, day=1)
-                    else:
-                        this = this.replace(month=1, day=1, year=this.year+1)
+                    year, month = _next_month(this.year, this.month)
+                    this = datetime.date(year, month, 1)
+
+        if self.weekday_mask is not None:
+            # Our own date always counts, whatever day of the week it is
+            mask = self.weekday_mask
+            return sorted(d for d in dates
+                          if d == self.date or (mask >> d.weekday()) & 1)
+        return sorted(dates)
+
+    def text_for(self, date):
+        """Return our text, as it should be reported for the given date.
+
+        We don't have many colon substitution words, so we can just deal
+        with them "by hand"
+
+            >>> e = Event(datetime.date(1960, 2, 18))
+            >>> e.text = 'Tibs is :age, born in :year'
+            >>> e.text_for(datetime.date(2013, 2, 18))
+            'Tibs is 53, born in 1960'
+        """
+        text = self._text
+        if ':year' in self.colon_words:
+            text = text.replace(':year', str(self.date.year))
+        if ':age' in self.colon_words:
+            text = text.replace(':age', str(date.year - self.date.year))
+        return text
 
+    def _rules(self):
+        """Return a list of our repetition rules, as (kind, value) tuples.
+        """
+        rules = []
+        if self.repeat_yearly:
+            if self.on_Nth_day_of_easter is not None:
+                rules.append(('easter', self.on_Nth_day_of_easter))
+            else:
+                rules.append(('yearly', None))
+        for n in self.repeat_every_N_days:
+            rules.append(('every', n))
+        for n in self.repeat_on_Nth_of_month:
+            rules.append(('monthly', n))
+        for index, day_name in self.repeat_ordinal:
+            rules.append(('ordinal', (index, day_name)))
+        return rules
+
+    def _rule_date_in_month(self, kind, value, year, month):
+        """Return the date a 'monthly' or 'ordinal' rule gives in a month.
+
+        Returns None if the rule does not give a date in that month.
+        """
+        if kind == 'monthly':
+            if value <= calendar.monthrange(year, month)[1]:
+                return datetime.date(year, month, value)
+            return None
+        else:
+            index, day_name = value
+            return calc_ordinal_day(datetime.date(year, month, 1),
+                                    index, day_name)
 
-        if self.not_on:
-            for date, reason in sorted(self.not_on):
-                if date in dates:
-                    dates.remove(date)
+    def _rule_gives(self, kind, value, date):
+        """Return True if the given rule gives 'date'.
+        """
+        if kind == 'yearly':
+            return (date.month, date.day) == (self.date.month, self.date.day)
+        elif kind == 'easter':
+            return date == calc_easter(date.year) + datetime.timedelta(days=value)
+        elif kind == 'every':
+            days = (date - self.date).days
+            return days > 0 and days % value == 0
+        elif kind == 'monthly':
+            return (date.day == value and
+                    (date.year, date.month) > (self.date.year, self.date.month))
+        else:
+            if (date.year, date.month) < (self.date.year, self.date.month):
+                return False
+            return self._rule_date_in_month(kind, value,
+                                            date.year, date.month) == date
 
-        if not dates:
-            return []
+    def _count_rule(self, kind, value, start, end):
+        """Count the dates the given rule gives from 'start' to 'end'.
 
-        # We don't have many colon substitution words, so we can just deal
-        # with them "by hand"
-        text = self._text
-        if ':year' in self.colon_words:
-            text = text.replace(':year', str(self.date.year))
+        The count is worked out arithmetically wherever that is possible,
+        with only the first and last month (or year) of the range being
+        looked at individually.
+        """
+        if kind == 'every':
+            first = max(1, -(-(start - self.date).days // value))
+            last = (end - self.date).days // value
+            return max(0, last - first + 1)
+
+        if kind in ('yearly', 'easter'):
+            count = 0
+            for year in set([start.year, end.year]):
+                if kind == 'easter':
+                    d = calc_easter(year) + datetime.timedelta(days=value)
+                else:
+                    try:
+                        d = self.date.replace(year=year)
+                    except ValueError:
+                        continue
+                if start <= d <= end:
+                    count += 1
+            if end.year - start.year > 1:
+                if kind == 'yearly' and (self.date.month, self.date.day) == (2, 29):
+                    count += calendar.leapdays(start.year+1, end.year)
+                else:
+                    count += end.year - start.year - 1
+            return count
 
-        things = set()
-        for date in dates:
-            if ':age' in self.colon_words:
-                text = text.replace(':age', str(date.year - self.date.year))
-            things.add((date, text, self))
+        # 'monthly' and 'ordinal' - both start in a particular month
+        if kind == 'monthly':
+            first_month = _next_month(self.date.year, self.date.month)
+        else:
+            first_month = (self.date.year, self.date.month)
+        first_month = max(first_month, (start.year, start.month))
+        last_month = (end.year, end.month)
+        if first_month > last_month:
+            return 0
+
+        count = 0
+        for year, month in set([first_month, last_month]):
+            d = self._rule_date_in_month(kind, value, year, month)
+            if d is not None and start <= d <= end:
+                count += 1
+
+        # And the whole months in between
+        inner = (last_month[0]*12 + last_month[1]) - (first_month[0]*12 + first_month[1]) - 1
+        if inner > 0:
+            if ((kind == 'monthly' and value <= 28) or
+                    (kind == 'ordinal' and value[0] != 5)):
+                # These occur in every month
+                count += inner
+            else:
+                year, month = _next_month(*first_month)
+                for n in range(inner):
+                    if self._rule_date_in_month(kind, value, year, month):
+                        count += 1
+                    year, month = _next_month(year, month)
+        return count
+
+    def count_dates(self, start, end):
+        """Return how many dates from 'start' to 'end' we occur on.
+
+        This is the same as len(self.occurrence_dates(start, end)), but where
+        we have (at most) one repetition rule, it is worked out without
+        generating each date.
+
+            >>> e = Event(datetime.date(2008, 10, 2))
+            >>> e.repeat_every_N_days.add(7)
+            >>> e.not_on.add(datetime.date(2013, 10, 3), reason='Doing something else')
+            >>> e.count_dates(datetime.date(2008, 10, 1), datetime.date(2013, 10, 10))
+            262
+            >>> len(e.occurrence_dates(datetime.date(2008, 10, 1), datetime.date(2013, 10, 10)))
+            262
+        """
+        if self.repeat_from and self.repeat_from > start:
+            start = self.repeat_from
+        if self.repeat_until and self.repeat_until < end:
+            end = self.repeat_until
+        if start > end:
+            return 0
+
+        rules = self._rules()
+        if len(rules) > 1:
+            # Two rules may give the same date, so it is simplest to
+            # generate the dates and let them be merged
+            return len(self.occurrence_dates(start, end))
+
+        # Count as if there were no ':except' conditions, and then take
+        # off the dates within each excluded range
+        count = self._count_ignoring_exclusions(rules, start, end)
+        for first, last in self.not_on.ranges_within(start, end):
+            count -= self._count_ignoring_exclusions(rules, first, last)
+        return count
+
+    def _count_ignoring_exclusions(self, rules, start, end):
+        if self.weekday_mask is not None:
+            if rules != [('every', 1)]:
+                return len(self._candidate_dates(start, end))
+            # Every day, but only on some days of the week - so every day
+            # after our own date with the right day of the week
+            count = count_weekdays(max(start, self.date + ONE_DAY), end,
+                                   self.weekday_mask)
+            if start <= self.date <= end:
+                count += 1
+            return count
+
+        count = 0
+        for kind, value in rules:
+            count += self._count_rule(kind, value, start, end)
+        # Our own date counts, unless the rule has already counted it
+        if start <= self.date <= end:
+            if not any(self._rule_gives(kind, value, self.date)
+                       for kind, value in rules):
+                count += 1
+        return count
+
+    def count_excluded(self, start, end):
+        """Return how many of our dates from 'start' to 'end' an ':except' removes.
+
+            >>> e = Event(datetime.date(2013, 10, 3))
+            >>> e.repeat_every_N_days.add(7)
+            >>> e.not_on.add(datetime.date(2013, 12, 20), datetime.date(2014, 1, 5))
+            >>> e.count_excluded(datetime.date(2013, 10, 1), datetime.date(2014, 3, 1))
+            2
+        """
+        if self.repeat_from and self.repeat_from > start:
+            start = self.repeat_from
+        if self.repeat_until and self.repeat_until < end:
+            end = self.repeat_until
+        if start > end or not self.not_on:
+            return 0
+        rules = self._rules()
+        if len(rules) > 1:
+            candidates = len(self._candidate_dates(start, end))
+        else:
+            candidates = self._count_ignoring_exclusions(rules, start, end)
+        return candidates - self.count_dates(start, end)
+
+    def is_excluded(self, date):
+        """Return True if an ':except' stops us occurring on 'date'.
+        """
+        return date in self.not_on
+
+    def _skips(self, date):
+        """Return True if we do not occur on 'date', even though a rule gives it.
+        """
+        if self.weekday_mask is not None and date != self.date:
+            if not (self.weekday_mask >> date.weekday()) & 1:
+                return True
+        return self.is_excluded(date)
+
+    def _first_on_or_after(self, date):
+        """Return the first date on or after 'date' that any of our rules give.
+
+        This ignores ':from', ':until' and ':except'. Returns None if there
+        is no such date.
+
+        Each rule works out its date directly, looking at no more than a
+        handful of months or years, however far 'date' is from our own date.
+        """
+        candidates = []
+        if self.date >= date:
+            candidates.append(self.date)
+
+        if self.repeat_yearly:
+            if self.on_Nth_day_of_easter is not None:
+                offset = datetime.timedelta(days=self.on_Nth_day_of_easter)
+                for year in (date.year, date.year+1):
+                    d = calc_easter(year) + offset
+                    if d >= date:
+                        candidates.append(d)
+                        break
+            else:
+                # Feb 29 may not come round again for 8 years
+                for year in range(date.year, date.year+9):
+                    try:
+                        d = self.date.replace(year=year)
+                    except ValueError:
+                        continue
+                    if d >= date:
+                        candidates.append(d)
+                        break
+
+        for n in self.repeat_every_N_days:
+            steps = max(1, -(-(date - self.date).days // n))
+            candidates.append(self.date + datetime.timedelta(days=steps*n))
+
+        for n in self.repeat_on_Nth_of_month:
+            year, month = _next_month(self.date.year, self.date.month)
+            if (year, month) < (date.year, date.month):
+                year, month = date.year, date.month
+            # A day of the month always occurs within the next few months
+            for count in range(12):
+                if n <= calendar.monthrange(year, month)[1]:
+                    d = datetime.date(year, month, n)
+                    if d >= date:
+                        candidates.append(d)
+                        break
+                year, month = _next_month(year, month)
+
+        for index, day_name in self.repeat_ordinal:
+            this = max(self.date, date).replace(day=1)
+            for count in range(12):
+                d = calc_ordinal_day(this, index, day_name)
+                if d is not None and d >= date:
+                    candidates.append(d)
+                    break
+                year, month = _next_month(this.year, this.month)
+                this = datetime.date(year, month, 1)
+
+        if candidates:
+            return min(candidates)
+        else:
+            return None
+
+    def _last_on_or_before(self, date):
+        """Return the last date on or before 'date' that any of our rules give.
+
+        This ignores ':from', ':until' and ':except'. Returns None if there
+        is no such date.
+        """
+        candidates = []
+        if self.date <= date:
+            candidates.append(self.date)
+
+        if self.repeat_yearly:
+            if self.on_Nth_day_of_easter is not None:
+                offset = datetime.timedelta(days=self.on_Nth_day_of_easter)
+                for year in (date.year, date.year-1):
+                    d = calc_easter(year) + offset
+                    if d <= date:
+                        candidates.append(d)
+                        break
+            else:
+                for year in range(date.year, date.year-9, -1):
+                    try:
+                        d = self.date.replace(year=year)
+                    except ValueError:
+                        continue
+                    if d <= date:
+                        candidates.append(d)
+                        break
+
+        for n in self.repeat_every_N_days:
+            steps = (date - self.date).days // n
+            if steps >= 1:
+                candidates.append(self.date + datetime.timedelta(days=steps*n))
+
+        for n in self.repeat_on_Nth_of_month:
+            # Repetitions start with the month after our original date
+            first = _next_month(self.date.year, self.date.month)
+            year, month = date.year, date.month
+            for count in range(12):
+                if (year, month) < first:
+                    break
+                if n <= calendar.monthrange(year, month)[1]:
+                    d = datetime.date(year, month, n)
+                    if d <= date:
+                        candidates.append(d)
+                        break
+                year, month = _previous_month(year, month)
+
+        for index, day_name in self.repeat_ordinal:
+            first = (self.date.year, self.date.month)
+            year, month = date.year, date.month
+            for count in range(12):
+                if (year, month) < first:
+                    break
+                d = calc_ordinal_day(datetime.date(year, month, 1),
+                                     index, day_name)
+                if d is not None and d <= date:
+                    candidates.append(d)
+                    break
+                year, month = _previous_month(year, month)
+
+        if candidates:
+            return max(candidates)
+        else:
+            return None
+
+    def next_date(self, after):
+        """Return the first date after 'after' on which we occur, or None.
+
+            >>> start=datetime.date(2013, 10, 1)
+            >>> events = parse_lines(
+            ...     [r':every Thu, @Charles Singing lesson',
+            ...      r'  :except 2013 Oct 3, Doing something else',
+            ...      r'  :until 2013 Oct 31'], start)
+            >>> event = events.pop()
+            >>> print(event.next_date(datetime.date(2013, 9, 1)))
+            2013-10-10
+            >>> print(event.next_date(datetime.date(2013, 10, 24)))
+            2013-10-31
+            >>> print(event.next_date(datetime.date(2013, 10, 31)))
+            None
+
+        A run of ':except' dates is skipped in one go, so a long exclusion
+        costs no more than a short one. If we still reject MAX_SKIPPED_DATES
+        dates in a row, we assume the event never occurs again.
+
+            >>> events = parse_lines(
+            ...     [r'2013 Oct 1, Daily check',
+            ...      r'  :every 1 days',
+            ...      r'  :except 2013 Oct 2 .. 2016 Oct 1, Away'], start)
+            >>> print(events.pop().next_date(datetime.date(2013, 10, 1)))
+            2016-10-02
+        """
+        date = after + ONE_DAY
+        if self.repeat_from and date < self.repeat_from:
+            date = self.repeat_from
+        for count in range(MAX_SKIPPED_DATES):
+            if self.repeat_until and date > self.repeat_until:
+                return None
+            d = self._first_on_or_after(date)
+            if d is None or (self.repeat_until and d > self.repeat_until):
+                return None
+            if not self._skips(d):
+                return d
+            # Jump straight past a run of ':except' dates
+            run = self.not_on.excluded_run(d)
+            if run is None:
+                date = d + ONE_DAY
+            else:
+                date = run[1] + ONE_DAY
+        return None
 
-        #return sorted(things)
-        return sorted(things, key=(lambda x: str(x).lower()))
+    def previous_date(self, before):
+        """Return the last date before 'before' on which we occur, or None.
+
+            >>> start=datetime.date(2013, 10, 1)
+            >>> events = parse_lines(
+            ...     [r':easter Fri, @pubhol Good Friday'], start)
+            >>> event = events.pop()
+            >>> print(event.previous_date(datetime.date(2013, 10, 1)))
+            2013-03-29
+            >>> print(event.next_date(datetime.date(2013, 10, 1)))
+            2014-04-18
+        """
+        date = before - ONE_DAY
+        if self.repeat_until and date > self.repeat_until:
+            date = self.repeat_until
+        for count in range(MAX_SKIPPED_DATES):
+            if self.repeat_from and date < self.repeat_from:
+                return None
+            d = self._last_on_or_before(date)
+            if d is None or (self.repeat_from and d < self.repeat_from):
+                return None
+            if not self._skips(d):
+                return d
+            run = self.not_on.excluded_run(d)
+            if run is None:
+                date = d - ONE_DAY
+            else:
+                date = run[0] - ONE_DAY
+        return None
 
 def colon_what(colon_word, words):
     """A simple utility to re-join :<word> commands for error reporting.
@@ -1211,7 +2199,8 @@ def colon_event_fifth(colon_word, words, start):
 
         * <day-name> -- the fifth day of that name in a month
 
-    NB: May return None if there is no fifth day of that name in this month
+    If there is no fifth day of that name in this month, the event starts
+    with the next month that does have one.
     """
     if len(words) != 1:
         raise GiveUp('Expected a day name, in {}'.format(
@@ -1222,13 +2211,15 @@ def colon_event_fifth(colon_word, words, start):
 
     day_name = words[0].capitalize()
     date = calc_ordinal_day(start, 5, day_name)
-    if date:
-        event = Event(date)
-        event.repeat_ordinal.add((5, day_name))
-        event.colon_date = colon_what(colon_word, words)
-        return event
-    else:
-        return None
+    this = start
+    while date is None:
+        year, month = _next_month(this.year, this.month)
+        this = datetime.date(year, month, 1)
+        date = calc_ordinal_day(this, 5, day_name)
+    event = Event(date)
+    event.repeat_ordinal.add((5, day_name))
+    event.colon_date = colon_what(colon_word, words)
+    return event
 
 def colon_event_last(colon_word, words, start):
     """The last <something>
@@ -1269,9 +2260,8 @@ def colon_event_lastbutone(colon_word, words, start):
 
     day_name = words[0].capitalize()
     date = calc_ordinal_day(start, -2, day_name)
-    date = day_before_date(a_week_before_end, day_name, True)
     event = Event(date)
-    event.repeat_ordinal.add((-1, day_name))
+    event.repeat_ordinal.add((-2, day_name))
     event.colon_date = colon_what(colon_word, words)
     return event
 
@@ -1449,17 +2439,51 @@ def colon_event_weekmagic(colon_word, words, start):
 def colon_condition_except(colon_word, event, words, start):
     """An exception condition.
 
+    Either a single date, or a range of dates, <date> .. <date>, possibly
+    followed by a comma and a reason.
+
     Applies to the preceding date line
+
+    For instance:
+
+        >>> start=datetime.date(2013, 12, 1)
+        >>> events = parse_lines(
+        ...     [r':every Mon, @Thomas Violin lesson',
+        ...      r'  :except 2013 Dec 21 .. 2014 Jan 5, Christmas holidays'],
+        ...     start)
+        >>> things = find_events(events, start, datetime.date(2014, 1, 15))
+        >>> report_events(things, start, False, False)
+         Mon  2 Dec 2013, @Thomas Violin lesson
+                          -------------------------------------------------------------
+         Mon  9 Dec 2013, @Thomas Violin lesson
+                          -------------------------------------------------------------
+         Mon 16 Dec 2013, @Thomas Violin lesson
+                          -------------------------------------------------------------
+         Mon  6 Jan 2014, @Thomas Violin lesson
+                          -------------------------------------------------------------
+         Mon 13 Jan 2014, @Thomas Violin lesson
+        >>> print(events.pop())
+        :every Mon, @Thomas Violin lesson
+          :every Mon
+          :except 2013 Dec 21 Sat .. 2014 Jan 5 Sun,  Christmas holidays
     """
     text = ' '.join(words)
     parts = text.split(',')
     date_part = parts[0]
     rest = ','.join(parts[1:])
-    eventlet = parse_date(date_part, start,
-                          'it does not make sense inside {}'.format(
-                          colon_what(colon_word, words)))
-    date = eventlet.date
-    event.not_on.add((date, rest))
+    reason = 'it does not make sense inside {}'.format(
+                colon_what(colon_word, words))
+    if '..' in date_part:
+        first_part, last_part = date_part.split('..', 1)
+        first = parse_date(first_part, start, reason).date
+        last = parse_date(last_part, start, reason).date
+        if last < first:
+            raise GiveUp('Date range in {!r} ends before it starts'.format(
+                colon_what(colon_word, words)))
+        event.not_on.add(first, last, rest)
+    else:
+        eventlet = parse_date(date_part, start, reason)
+        event.not_on.add(eventlet.date, reason=rest)
 
 def colon_condition_until(colon_word, event, words, start):
     """An ending condition.
@@ -1593,9 +2617,12 @@ def colon_condition_every(colon_word, event, words, start):
     event.repeat_every_N_days.add(every)
 
 def colon_condition_for(colon_word, event, words, start):
-    """Repeat for <count> days or weekdays
+    """Repeat for <count> days, weekdays or workdays
 
-    As in ":for 5 days" or ":for 10 weekdays"
+    As in ":for 5 days" or ":for 10 weekdays" or ":for 10 workdays @pubhol".
+    In the last case, the working days are the weekdays that are not holidays,
+    where the holidays are the dates of the events with that @<word>.
+    ':for 10 workdays', without an @<word>, is the same as ':for 10 weekdays'.
 
     For instance:
 
@@ -1675,8 +2702,31 @@ def colon_condition_for(colon_word, event, words, start):
          Thu 21 Nov 2013, @work Something
          Fri 22 Nov 2013, @work Something
 
+    and:
+
+        >>> start=datetime.date(2013, 12, 1)
+        >>> end  =datetime.date(2014, 1, 31)
+        >>> events = parse_lines(
+        ...     [r'2013 Dec 25 Wed, @pubhol Christmas Day',
+        ...      r'2013 Dec 26 Thu, @pubhol Boxing Day',
+        ...      r'2013 Dec 23 Mon, @work Something',
+        ...      r'  :for 5 workdays @pubhol'], start)
+        >>> things = find_events(events, start, end, set(['@work']))
+        >>> report_events(things, start, False, False)
+         Mon 23 Dec 2013, @work Something
+         Tue 24 Dec 2013, @work Something
+         Fri 27 Dec 2013, @work Something
+                          -------------------------------------------------------------
+         Mon 30 Dec 2013, @work Something
+         Tue 31 Dec 2013, @work Something
     """
-    if len(words) != 2 or words[1].lower() not in ('days', 'weekdays'):
+    holidays = None
+    if len(words) == 3 and words[1].lower() == 'workdays':
+        if not words[2].startswith('@'):
+            raise GiveUp("Expected ':for <num> workdays @<word>'\n"
+                         'not {!r}'.format(colon_what(colon_word, words)))
+        holidays = words[2].lower()
+    elif len(words) != 2 or words[1].lower() not in ('days', 'weekdays', 'workdays'):
         raise GiveUp("Expected ':repeat <num> days'\n"
                      'not {!r}'.format(colon_what(colon_word, words)))
 
@@ -1687,6 +2737,10 @@ def colon_condition_for(colon_word, event, words, start):
         raise GiveUp('Expected:\n'
                      '  :for <count> {}\n'
                      'not {!r}'.format(what, colon_what(colon_word, words)))
+    if holidays:
+        # We can't work this out until we know what all the holidays are
+        event.for_workdays = (count, holidays)
+        return
     # Repeat daily until told to stop...
     event.repeat_every_N_days.add(1)
     if what == 'days':
@@ -1694,19 +2748,10 @@ def colon_condition_for(colon_word, event, words, start):
     else:
         # Hah - weekdays only, except that the event date itself is always
         # included, whether it is a weekday or not
-        ##print('xxx count = {}'.format(count))
         if 0 <= event.date.weekday() <= 4:       # we're a weekday
             count -= 1                      # so we also count
-            ##print('xxx this is a weekday -> count = {}'.format(count))
-        until = event.date
-        while count > 0:
-            next = until + ONE_DAY
-            while next.weekday() in (5,6):
-                event.not_on.add((next, 'excluding weekends in {!r}'.format(
-                    colon_what(colon_word, words))))
-                next = next + ONE_DAY
-            until = next
-            count -= 1
+        until = add_weekdays(event.date, count)
+        event.weekday_mask = WEEKDAYS_MASK
     if event.repeat_until is None:
         ##print('xxx Using this <until>')
         event.repeat_until = until
@@ -1714,6 +2759,31 @@ def colon_condition_for(colon_word, event, words, start):
         ##print('xxx Using this <until> as it is earlier')
         event.repeat_until = until
 
+def colon_condition_weekdays(colon_word, event, words, start):
+    """Only repeat on weekdays (Mon..Fri)
+
+    'words' should be empty.
+
+    The original date of the event is still kept, even if it is a Sat or Sun.
+
+    Applies to the preceding date line
+
+    An event whose rules only ever give a Sat or Sun would never occur
+    again, so is not allowed:
+
+        >>> parse_lines([r':every Sat, Weekend only',
+        ...              r'  :weekdays'], datetime.date(2013, 10, 1))
+        Traceback (most recent call last):
+        ...
+        GiveUp: Error in line 1
+        Event repeats only at weekends, but is limited to ":weekdays"
+        1: ':every Sat, Weekend only'
+    """
+    if words:
+        raise GiveUp('Not expecting text after :weekdays, in {!r}'.format(
+            colon_what(colon_word, words)))
+    event.weekday_mask = WEEKDAYS_MASK
+
 colon_event_methods = {':every': colon_event_every,
                        ':first': colon_event_first,
                        ':second': colon_event_second,
@@ -1743,6 +2813,7 @@ colon_condition_methods = {':except': colon_condition_except,
                            ':yearly': colon_condition_yearly,
                            ':every': colon_condition_every,
                            ':for': colon_condition_for,
+                           ':weekdays': colon_condition_weekdays,
                           }
 
 def yield_lines(lines):
@@ -1909,6 +2980,9 @@ def parse_event(first_lineno, first_line, more_lines, start):
                      '{}: {!r}'.format(first_lineno, e,
                                        first_lineno, first_line))
     event.text = rest
+    event.source = first_line.strip()
+    event.source_lines = [event.source] + [text.strip() for text in more_lines]
+    event.anchored = event.colon_date is not None
 
     this_lineno = first_lineno
     for text in more_lines:
@@ -1916,6 +2990,8 @@ def parse_event(first_lineno, first_line, more_lines, start):
         words = text.split()
         if words[0][0] == ':':
             colon_word = words[0].lower()
+            if any(word.startswith(':') for word in words[1:]):
+                event.anchored = True
             try:
                 fn = colon_condition_methods[colon_word]
                 fn(colon_word, event, words[1:], start)
@@ -1932,8 +3008,216 @@ def parse_event(first_lineno, first_line, more_lines, start):
             raise GiveUp('Error in line {}\n'
                          'Indented line should be a <condition>, starting with a colon,\n'
                          '{}: {!r}'.format(this_lineno, this_lineno, text))
+
+    if event.repeat_until and not event.repeats():
+        # Hah, they didn't say how often to repeat "until".
+        # So let's assume daily...
+        event.repeat_every_N_days.add(1)
+
+    # If ':weekdays' rules out every day our rules give, we would never
+    # occur again, and searching for our next date would never end
+    if (event.weekday_mask is not None and event.repeats() and
+            not event.rule_weekdays() & event.weekday_mask):
+        raise GiveUp('Error in line {}\n'
+                     'Event repeats only at weekends, but is limited to'
+                     ' ":weekdays"\n'
+                     '{}: {!r}'.format(first_lineno, first_lineno, first_line))
     return event
 
+class WorkingDays(object):
+    """Working days - Mon..Fri, but not holidays - from 'start' to 'end'.
+
+    The holidays are the dates of 'holiday_events' (as found by find_events,
+    so their ':except' conditions, and so on, are honoured), and if 'at_word'
+    is given, only those events with that @<word> count as holidays.
+
+    The holidays are kept as a bit set (one bit per day, in a Python int),
+    and we also keep a running count of the working days and a list of the
+    working days themselves, so adding working days to a date, or counting
+    them, takes the same time however far apart the dates are.
+
+        >>> start = datetime.date(2013, 12, 1)
+        >>> holidays = parse_lines(
+        ...     [r'2013 Dec 25 Wed, @pubhol Christmas Day',
+        ...      r'2013 Dec 26 Thu, @pubhol Boxing Day',
+        ...      r'2014 Jan  1 Wed, @pubhol New Year',
+        ...      r'2013 Dec 24 Tue, @birthday Someone'], start)
+        >>> days = WorkingDays(holidays, start, datetime.date(2014, 1, 31), '@pubhol')
+        >>> print(days.add(datetime.date(2013, 12, 23), 3))
+        2013-12-30
+        >>> days.count(datetime.date(2013, 12, 23), datetime.date(2014, 1, 3))
+        7
+    """
+
+    def __init__(self, holiday_events, start, end, at_word=None):
+        self.start = start
+        self.end = end
+        self.at_word = at_word
+        first = start.toordinal()
+        num_days = end.toordinal() - first + 1
+
+        if at_word:
+            at_words = set([at_word.lower()])
+        else:
+            at_words = None
+        self.holidays = 0
+        for date, text, event in find_events(holiday_events, start, end, at_words):
+            self.holidays |= 1 << (date.toordinal() - first)
+
+        # prefix[i] is the number of working days before start + i days
+        self._prefix = array.array('i', [0])
+        # The ordinal of each working day, in order
+        self._working = array.array('i')
+        weekday = start.weekday()
+        for offset in range(num_days):
+            if weekday < 5 and not (self.holidays >> offset) & 1:
+                self._working.append(first + offset)
+            self._prefix.append(len(self._working))
+            weekday = (weekday + 1) % 7
+
+    def _offset(self, date):
+        offset = date.toordinal() - self.start.toordinal()
+        if not 0 <= offset < len(self._prefix) - 1:
+            raise GiveUp('Date {} is outside the working days calculated'
+                         ' ({} .. {})'.format(date, self.start, self.end))
+        return offset
+
+    def is_holiday(self, date):
+        """Return True if 'date' is one of our holidays.
+        """
+        return bool((self.holidays >> self._offset(date)) & 1)
+
+    def is_working_day(self, date):
+        """Return True if 'date' is a working day.
+        """
+        offset = self._offset(date)
+        return self._prefix[offset+1] != self._prefix[offset]
+
+    def count(self, start, end):
+        """Return how many working days there are from 'start' to 'end' (inclusive).
+        """
+        if start > end:
+            return 0
+        return self._prefix[self._offset(end)+1] - self._prefix[self._offset(start)]
+
+    def add(self, date, count):
+        """Return the date 'count' working days after 'date'.
+
+        If 'count' is 0 (or less), just returns 'date'.
+        """
+        if count <= 0:
+            return date
+        # The number of working days up to and including 'date' is also
+        # the index of the next working day after it
+        index = self._prefix[self._offset(date)+1] + count - 1
+        if index >= len(self._working):
+            raise GiveUp('{} working days after {} is after {}, the end of the'
+                         ' working days calculated'.format(count, date, self.end))
+        return datetime.date.fromordinal(self._working[index])
+
+    def holidays_within(self, start, end):
+        """Yield the holidays from 'start' to 'end' (inclusive).
+        """
+        first = self._offset(start)
+        last = self._offset(end)
+        bits = self.holidays >> first
+        offset = first
+        while bits and offset <= last:
+            if bits & 1:
+                yield datetime.date.fromordinal(self.start.toordinal() + offset)
+            bits >>= 1
+            offset += 1
+
+# How many years past the end of ':for <count> workdays' we will look for
+# enough working days before deciding the holidays cover them all
+MAX_WORKDAY_YEARS = 10
+
+def resolve_workdays(events):
+    """Work out the end date of any ':for <count> workdays @<word>' events.
+
+    This has to wait until all the events have been read, since the holidays
+    are those other events with the given @<word>. The event then becomes
+    the equivalent of ':until <date>' and ':weekdays', with an ':except' for
+    each holiday within that span.
+
+    A holiday may itself be a ':for <count> workdays' event, in which case it
+    is worked out first, but holidays may not (even indirectly) depend on
+    the event they are holidays for:
+
+        >>> start = datetime.date(2013, 12, 1)
+        >>> parse_lines([r'2013 Dec 2, @term Autumn term',
+        ...              r'  :for 10 workdays @half',
+        ...              r'2013 Dec 9, @half Half term',
+        ...              r'  :for 3 workdays @term'], start)
+        Traceback (most recent call last):
+        ...
+        GiveUp: Cannot work out ':for 10 workdays @half', as its holidays depend on it
+        2013 Dec 2, @term Autumn term
+
+    and there must be enough working days left once the holidays are taken
+    out:
+
+        >>> parse_lines([r'2013 Dec 1, @pubhol Strike',
+        ...              r'  :every 1 days',
+        ...              r'2013 Dec 2, Project',
+        ...              r'  :for 5 workdays @pubhol'], start)
+        Traceback (most recent call last):
+        ...
+        GiveUp: Cannot find 5 working days (outside @pubhol) after 2013-12-02
+        2013 Dec 2, Project
+    """
+    resolving = set()
+    for event in events:
+        _resolve_workdays(event, events, resolving)
+
+def _resolve_workdays(event, events, resolving):
+    """Resolve ':for <count> workdays' for 'event', and for its holidays.
+
+    'resolving' holds the id() of each event we are part way through, so we
+    can tell if an event ends up (indirectly) depending on itself.
+    """
+    if event.for_workdays is None:
+        return
+    count, at_word = event.for_workdays
+    if id(event) in resolving:
+        raise GiveUp("Cannot work out ':for {} workdays {}', as its holidays"
+                     " depend on it\n{}".format(count, at_word, event.source))
+    resolving.add(id(event))
+    holidays = [other for other in events
+                if other is not event and at_word in other.at_words]
+    for other in holidays:
+        _resolve_workdays(other, events, resolving)
+    resolving.discard(id(event))
+    if any(other.anchored for other in holidays):
+        event.anchored = True
+    # Guess how far ahead we need to look, and keep looking further
+    # ahead until we have enough working days (but not for ever, in case
+    # the holidays cover every working day)
+    limit = count * 7 + MAX_WORKDAY_YEARS * 366
+    span = count * 2 + 31
+    while True:
+        end = event.date + datetime.timedelta(days=span)
+        working = WorkingDays(holidays, event.date, end, at_word)
+        if working.count(event.date + ONE_DAY, end) >= count:
+            break
+        if span >= limit:
+            raise GiveUp('Cannot find {} working days (outside {}) after {}'
+                         '\n{}'.format(count, at_word, event.date, event.source))
+        span = min(span * 2, limit)
+    # As with weekdays, our own date is always included, but only
+    # counts if it is a working day
+    if working.is_working_day(event.date):
+        count -= 1
+    until = working.add(event.date, count)
+    for date in working.holidays_within(event.date + ONE_DAY, until):
+        if date.weekday() < 5:
+            event.not_on.add(date, reason='{} holiday'.format(at_word))
+    event.repeat_every_N_days.add(1)
+    event.weekday_mask = WEEKDAYS_MASK
+    if event.repeat_until is None or event.repeat_until > until:
+        event.repeat_until = until
+    event.for_workdays = None
+
 def parse_lines(lines, start):
     r"""Report on the given lines.
 
@@ -2001,11 +3285,14 @@ def parse_lines(lines, start):
         not 'Fred'
         1: 'Fred, Jim'
     """
-    events = set()
+    events = []
     for first_lineno, this_lines in yield_lines(lines):
         event = parse_event(first_lineno, this_lines[0], this_lines[1:], start)
-        events.add(event)
-    return events
+        events.append(event)
+    resolve_workdays(events)
+    for event in events:
+        event.freeze()
+    return set(events)
 
 def parse_file(filename, start):
     """Report on the information in the named file.
@@ -2014,26 +3301,880 @@ def parse_file(filename, start):
         events = parse_lines(fd, start)
     return events
 
-def find_events(events, start, end, at_words=None):
-    """Return (date, text, event) tuples for the events in our date range.
+def is_event_store(filename):
+    """Is the named file an EventStore (rather than a text file)?
     """
-    things = set()
-    for event in events:
-        things.update(event.get_dates(start, end, at_words))
-
-    return things
+    return os.path.splitext(filename)[1].lower() in EVENT_STORE_EXTENSIONS
 
-def determine_dates(start=None, today=None, end=None):
-    """Given the three "bounding" dates, validate and expand them.
+def read_events(filename, start, end=None, at_words=None):
+    """Return the events from the named file, which may be an EventStore.
 
-    Returns actual values for start, yesterday, today, end
+    For an EventStore, only the events that might occur from 'start' to
+    'end' (if given), with any of 'at_words' (if given), are read. A text
+    file is always read in full.
     """
-    if today is None:
-        today = datetime.date.today()
+    if is_event_store(filename):
+        store = EventStore(filename)
+        try:
+            return store.events(start, end, at_words)
+        finally:
+            store.close()
+    else:
+        return parse_file(filename, start)
 
-    yesterday = today - datetime.timedelta(days=1)
+class ExpansionCache(object):
+    """Remember the dates on which events occur, a month at a time.
 
-    if start is None:
+    Interactive use tends to ask for lots of overlapping date ranges (the
+    default four weeks, then '-m', then '-around' some date, and so on).
+    Rather than working out each event's dates from scratch each time, we
+    remember them for each (rule signature, year, month), so that events
+    with the same rules share them, and only work out those months we have
+    not seen before. The least recently used months are forgotten once we
+    have more than 'max_months' of them.
+
+    For instance:
+
+        >>> start=datetime.date(2013, 10, 1)
+        >>> events = parse_lines([r':every Thu, @Charles Singing lesson'], start)
+        >>> cache = ExpansionCache()
+        >>> things = find_events(events, start, datetime.date(2013, 11, 30), cache=cache)
+        >>> cache.hits, cache.misses
+        (0, 2)
+        >>> things = find_events(events, datetime.date(2013, 11, 15),
+        ...                      datetime.date(2013, 12, 15), cache=cache)
+        >>> cache.hits, cache.misses
+        (1, 3)
+        >>> len(things)
+        4
+    """
+
+    def __init__(self, max_months=100000):
+        self.max_months = max_months
+        self.hits = 0
+        self.misses = 0
+        self._months = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._months)
+
+    def clear(self):
+        """Forget everything, including the hit and miss counts.
+        """
+        with self._lock:
+            self._months.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def _month_dates(self, event, year, month):
+        """Return the dates on which 'event' occurs in the given month.
+        """
+        key = (rule_signature(event), year, month)
+        with self._lock:
+            dates = self._months.pop(key, None)
+            if dates is not None:
+                # Re-inserting it makes it the most recently used
+                self._months[key] = dates
+                self.hits += 1
+                return dates
+            self.misses += 1
+
+        first = datetime.date(year, month, 1)
+        last = first.replace(day=calendar.monthrange(year, month)[1])
+        dates = tuple(event.occurrence_dates(first, last))
+
+        with self._lock:
+            self._months[key] = dates
+            while len(self._months) > self.max_months:
+                self._months.popitem(last=False)
+        return dates
+
+    def occurrence_dates(self, event, start, end):
+        """Return the same as event.occurrence_dates(start, end).
+        """
+        dates = []
+        year, month = start.year, start.month
+        while (year, month) <= (end.year, end.month):
+            for date in self._month_dates(event, year, month):
+                if start <= date <= end:
+                    dates.append(date)
+            year, month = _next_month(year, month)
+        return dates
+
+def rule_signature(event):
+    """Return a key for the dates 'event' occurs on, ignoring its text.
+
+    That is, its date and all of its repetition rules, ':from', ':until'
+    and ':except' (but not the reasons given for the ':except'). Events
+    with the same signature occur on the same dates, so (for instance)
+    a dozen different ':first Tue' events need only be expanded once.
+
+        >>> start = datetime.date(2013, 10, 1)
+        >>> events = dict((event.text, event) for event in parse_lines(
+        ...     [r':first Tue, Ipswich',
+        ...      r':first Tue, Python User Group',
+        ...      r'  :except 2013 Dec 3, Christmas do instead',
+        ...      r':first Tue, Choir',
+        ...      r'  :except 2013 Dec 3'], start))
+        >>> rule_signature(events['Ipswich']) == rule_signature(events['Choir'])
+        False
+        >>> rule_signature(events['Python User Group']) == rule_signature(events['Choir'])
+        True
+    """
+    signature = getattr(event, '_signature', None)
+    if signature is None:
+        record = event_to_record(event)
+        # Leave out the text and the (textual) colon date, and the reasons
+        # for any ':except'
+        signature = ((record[0],) + record[3:10] +
+                     (tuple((first, last) for first, last, reason in record[10]),
+                      record[11]))
+    return signature
+
+def _event_dates(events, start, end, at_words=None, cache=None, where=None):
+    """Yield (event, dates) for the events in our date range (see find_events).
+    """
+    if where is not None:
+        # Events with the same rules (and the same mask) have the same dates
+        sharing = {}
+        for event in events:
+            if at_words and not at_words.intersection(event.at_words):
+                continue
+            mask = where.day_mask(event)
+            if mask:
+                sharing.setdefault((rule_signature(event), mask), []).append(event)
+        for (signature, mask), these in sharing.items():
+            dates = where.occurrence_dates(these[0], start, end, mask, cache)
+            for event in these:
+                yield event, dates
+    elif cache is None:
+        # Work out the dates once for each distinct set of rules, and then
+        # give them to each event that has those rules
+        sharing = {}
+        for event in events:
+            if at_words and not at_words.intersection(event.at_words):
+                continue
+            sharing.setdefault(rule_signature(event), []).append(event)
+        for these in sharing.values():
+            dates = these[0].occurrence_dates(start, end)
+            for event in these:
+                yield event, dates
+    else:
+        for event in events:
+            if at_words and not at_words.intersection(event.at_words):
+                continue
+            yield event, cache.occurrence_dates(event, start, end)
+
+def find_events(events, start, end, at_words=None, cache=None, where=None,
+                table=False):
+    """Return (date, text, event) tuples for the events in our date range.
+
+    If 'cache' is given, it should be an ExpansionCache, which will be used
+    to remember (and reuse) the dates each event occurs on.
+
+    If 'where' is given, it should be an EventFilter, and only the events
+    (and dates) it allows will be returned.
+
+    If 'table' is true, return an OccurrenceTable instead of a set of
+    tuples.
+    """
+    if table:
+        occurrences = OccurrenceTable()
+        for event, dates in _event_dates(events, start, end, at_words, cache, where):
+            occurrences.add_dates(event, dates)
+        return occurrences
+
+    things = set()
+    for event, dates in _event_dates(events, start, end, at_words, cache, where):
+        things.update((date, event.text_for(date), event) for date in dates)
+    return things
+
+class OccurrenceTable(object):
+    """Occurrences, kept as columns rather than (date, text, event) tuples.
+
+    Each occurrence is a day ordinal and the index of its event, held in
+    two parallel arrays. Its text is only worked out (with any ':age' or
+    ':year' filled in) when the occurrence is actually looked at, so a large
+    table takes much less memory than the equivalent set of tuples.
+
+    Iterating over a table gives (date, text, event) tuples, in no
+    particular order, so it can be used wherever such a set could be.
+    sorted_rows() gives them in the order they are reported.
+
+        >>> start = datetime.date(2013, 10, 1)
+        >>> events = parse_lines(
+        ...     [r':every Thu, 17:00 @Charles Singing lesson',
+        ...      r'2001* Oct 10, @Charles is :age',
+        ...      r':first Tue, @Bethany Ipswich'], start)
+        >>> table = find_events(events, start, datetime.date(2013, 10, 14),
+        ...                     table=True)
+        >>> len(table)
+        4
+        >>> for date, text, event in table.sorted_rows():
+        ...     print(date, text)
+        2013-10-01 @Bethany Ipswich
+        2013-10-03 17:00 @Charles Singing lesson
+        2013-10-10 @Charles is 12
+        2013-10-10 17:00 @Charles Singing lesson
+        >>> set(table) == find_events(events, start, datetime.date(2013, 10, 14))
+        True
+    """
+
+    def __init__(self):
+        self.events = []
+        self.ordinals = array.array('i')
+        self.event_indices = array.array('i')
+        self._index_of = {}
+
+    def __len__(self):
+        return len(self.ordinals)
+
+    def add_dates(self, event, dates):
+        """Add the occurrences of 'event' on each of 'dates'.
+        """
+        index = self._index_of.get(id(event))
+        if index is None:
+            index = self._index_of[id(event)] = len(self.events)
+            self.events.append(event)
+        self.ordinals.extend(date.toordinal() for date in dates)
+        self.event_indices.extend(itertools.repeat(index, len(dates)))
+
+    def _row(self, row):
+        date = datetime.date.fromordinal(self.ordinals[row])
+        event = self.events[self.event_indices[row]]
+        return date, event.text_for(date), event
+
+    def __iter__(self):
+        for row in range(len(self.ordinals)):
+            yield self._row(row)
+
+    def dates_and_events(self):
+        """Yield (date, event) for each occurrence, without working out texts.
+        """
+        events = self.events
+        for ordinal, index in zip(self.ordinals, self.event_indices):
+            yield datetime.date.fromordinal(ordinal), events[index]
+
+    def sorted_rows(self):
+        """Yield (date, text, event) tuples in the same order as
+        sorted(things, key=occurrence_sort_key) would give.
+
+        Only events whose text changes with the date (because of ':age' or
+        ':year') need their text working out in order to sort them.
+        """
+        event_keys = []
+        for event in self.events:
+            if ':age' in event.colon_words or ':year' in event.colon_words:
+                event_keys.append(None)
+            else:
+                span = event.time_span
+                event_keys.append((span is not None, span or (0, 0), event.text))
+        ordinals = self.ordinals
+        indices = self.event_indices
+        events = self.events
+
+        def key(row):
+            index = indices[row]
+            event_key = event_keys[index]
+            if event_key is None:
+                date = datetime.date.fromordinal(ordinals[row])
+                event = events[index]
+                span = event.time_span
+                event_key = (span is not None, span or (0, 0), event.text_for(date))
+            return (ordinals[row], event_key, events[index])
+
+        for row in sorted(range(len(ordinals)), key=key):
+            yield self._row(row)
+
+def find_events_concurrently(events, queries, max_workers=None):
+    """Run several queries against the same events at once, using threads.
+
+    Each query is a tuple of the form (start, end) or (start, end, at_words),
+    and the result is a list with one entry for each query, as returned by
+    find_events. The events are only read, never altered, so they may be
+    shared with other threads whilst this is happening.
+
+    For instance:
+
+        >>> start=datetime.date(2013, 10, 1)
+        >>> events = parse_lines(
+        ...     [r':every Thu, @Charles Singing lesson',
+        ...      r':first Tue, @Bethany Ipswich'], start)
+        >>> results = find_events_concurrently(events,
+        ...     [(datetime.date(2013, 10, 1), datetime.date(2013, 10, 7)),
+        ...      (datetime.date(2013, 10, 1), datetime.date(2013, 10, 31),
+        ...       set(['@bethany']))])
+        >>> for things in results:
+        ...     print([(str(date), text) for date, text, event in sorted(things)])
+        [('2013-10-01', '@Bethany Ipswich'), ('2013-10-03', '@Charles Singing lesson')]
+        [('2013-10-01', '@Bethany Ipswich')]
+    """
+    # Make sure we can iterate over the events more than once
+    if not isinstance(events, (set, frozenset, list, tuple)):
+        events = list(events)
+    try:
+        from concurrent.futures import ThreadPoolExecutor
+    except ImportError:
+        # Python 2 without the "futures" package - just run them in turn
+        return [find_events(events, *query) for query in queries]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(lambda query: find_events(events, *query),
+                                 queries))
+
+def event_to_record(event):
+    """Return a compact tuple describing an Event.
+
+    The tuple contains only simple values (dates become day ordinals), so
+    it is cheap to pickle, and event_from_record() can turn it back into an
+    equivalent Event:
+
+        >>> start=datetime.date(2013, 10, 1)
+        >>> events = parse_lines(
+        ...     [r':every Thu, @Charles Singing lesson',
+        ...      r'  :except 2013 Oct 3, Doing something else'], start)
+        >>> event = events.pop()
+        >>> event_from_record(event_to_record(event)) == event
+        True
+    """
+    return (event.date.toordinal(),
+            event.text,
+            event.colon_date,
+            event.repeat_yearly,
+            tuple(sorted(event.repeat_every_N_days)),
+            tuple(sorted(event.repeat_on_Nth_of_month)),
+            event.on_Nth_day_of_easter,
+            event.repeat_from.toordinal() if event.repeat_from else None,
+            event.repeat_until.toordinal() if event.repeat_until else None,
+            tuple(sorted(event.repeat_ordinal)),
+            tuple((first.toordinal(), last.toordinal(), reason)
+                  for first, last, reason in event.not_on),
+            event.weekday_mask,
+           )
+
+def event_from_record(record, source=None):
+    """Return a (frozen) Event, given a tuple from event_to_record().
+    """
+    (date, text, colon_date, yearly, every_N_days, Nth_of_month,
+     Nth_day_of_easter, repeat_from, repeat_until, ordinal, not_on,
+     weekday_mask) = record
+    event = Event(datetime.date.fromordinal(date))
+    event.text = text
+    event.colon_date = colon_date
+    event.repeat_yearly = yearly
+    event.repeat_every_N_days.update(every_N_days)
+    event.repeat_on_Nth_of_month.update(Nth_of_month)
+    event.on_Nth_day_of_easter = Nth_day_of_easter
+    if repeat_from is not None:
+        event.repeat_from = datetime.date.fromordinal(repeat_from)
+    if repeat_until is not None:
+        event.repeat_until = datetime.date.fromordinal(repeat_until)
+    event.repeat_ordinal.update(ordinal)
+    event.weekday_mask = weekday_mask
+    for first, last, reason in not_on:
+        event.not_on.add(datetime.date.fromordinal(first),
+                         datetime.date.fromordinal(last), reason)
+    event.source = source
+    event.anchored = colon_date is not None
+    event.freeze()
+    return event
+
+def _expand_records(records, start_ordinal, end_ordinal):
+    """Expand (index, record) pairs, for find_events_parallel.
+
+    Returns a sorted list of (date-ordinal, text, index) tuples.
+
+    This is run in a worker process, so it only takes and returns simple
+    values.
+    """
+    start = datetime.date.fromordinal(start_ordinal)
+    end = datetime.date.fromordinal(end_ordinal)
+    result = []
+    for index, record in records:
+        event = event_from_record(record)
+        for date in event.occurrence_dates(start, end):
+            result.append((date.toordinal(), event.text_for(date), index))
+    result.sort()
+    return result
+
+def _split(sequence, num_parts):
+    """Split 'sequence' into (at most) 'num_parts' contiguous lists.
+    """
+    size = -(-len(sequence) // num_parts)
+    return [sequence[i:i+size] for i in range(0, len(sequence), size)]
+
+def find_events_parallel(events, start, end, at_words=None,
+                         max_workers=None, window_shards=1):
+    """Like find_events, but spread the work over several processes.
+
+    The events are split into shards (and, if 'window_shards' is more than
+    one, so is the date range), each shard is expanded in a separate process,
+    and the (sorted) results are merged. If concurrent.futures is not
+    available (Python 2 without the "futures" package), the shards are
+    expanded one after another in this process instead.
+
+    Returns a sorted list of (date, text, event) tuples - that is, the same
+    as sorted(find_events(events, start, end, at_words)).
+
+        >>> start=datetime.date(2013, 10, 1)
+        >>> end=datetime.date(2015, 10, 1)
+        >>> events = parse_lines(
+        ...     [r':every Thu, @Charles Singing lesson',
+        ...      r':first Tue, @Bethany Ipswich',
+        ...      r'1980* Oct  9, @Birthday: @Alfred is :age, born in :year'],
+        ...     start)
+        >>> things = find_events_parallel(events, start, end, max_workers=2,
+        ...                               window_shards=3)
+        >>> things == sorted(find_events(events, start, end))
+        True
+    """
+    if at_words:
+        events = [event for event in events
+                  if at_words.intersection(event.at_words)]
+    # Numbering the events in sorted order means that sorting on the index
+    # sorts the same as sorting on the events themselves
+    events = sorted(events)
+    if not events or start > end:
+        return []
+
+    if max_workers is None:
+        max_workers = multiprocessing.cpu_count()
+    # Use rather more shards than workers, so that one shard full of
+    # expensive events doesn't leave the other workers idle
+    records = [(index, event_to_record(event))
+               for index, event in enumerate(events)]
+    event_shards = _split(records, max_workers * 4)
+
+    start_ordinal = start.toordinal()
+    end_ordinal = end.toordinal()
+    window_shards = max(1, min(window_shards, end_ordinal - start_ordinal + 1))
+    step = -(-(end_ordinal - start_ordinal + 1) // window_shards)
+    windows = [(first, min(first + step - 1, end_ordinal))
+               for first in range(start_ordinal, end_ordinal + 1, step)]
+
+    try:
+        from concurrent.futures import ProcessPoolExecutor
+    except ImportError:
+        results = [_expand_records(shard, first, last)
+                   for shard in event_shards
+                   for first, last in windows]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(_expand_records, shard, first, last)
+                       for shard in event_shards
+                       for first, last in windows]
+            results = [future.result() for future in futures]
+
+    return [(datetime.date.fromordinal(ordinal), text, events[index])
+            for ordinal, text, index in heapq.merge(*results)]
+
+class CalendarRegistry(object):
+    """Serve many people's calendars from one set of parsed files.
+
+    Most people's calendars include the same few files (public holidays,
+    the company calendar, and so on), so each distinct file is parsed only
+    once, and the resulting events are kept as an immutable set, keyed by
+    the hash of the file's content. Each person's calendar is then just a
+    list of references to those shared sets, plus any events that are
+    private to them. So memory grows with the number of distinct files,
+    not with the number of people.
+
+    Note that colon dates (':every Thu', and so on) are anchored on the
+    'start' date given when the files are parsed, so a registry uses the
+    same 'start' for all of its files.
+
+    For instance:
+
+        >>> start = datetime.date(2013, 10, 1)
+        >>> registry = CalendarRegistry(start)
+        >>> holidays = [r'2013 Dec 25 Wed, @pubhol Christmas Day']
+        >>> alfred = registry.add_view('alfred', [holidays],
+        ...                            [r'2013 Dec 24 Tue, @Alfred Shopping'])
+        >>> bethany = registry.add_view('bethany', [holidays])
+        >>> registry.num_shared()
+        1
+        >>> end = datetime.date(2013, 12, 31)
+        >>> for date, text, event in sorted(registry.find_events('alfred', start, end)):
+        ...     print(date, text)
+        2013-12-24 @Alfred Shopping
+        2013-12-25 @pubhol Christmas Day
+        >>> for date, text, event in sorted(registry.find_events('bethany', start, end)):
+        ...     print(date, text)
+        2013-12-25 @pubhol Christmas Day
+        >>> len(list(alfred)), len(list(alfred))
+        (2, 2)
+
+    A shared set is forgotten when the last calendar using it is removed,
+    unless it was added directly (with add_lines or add_file):
+
+        >>> registry.remove_view('alfred')
+        >>> registry.num_shared()
+        1
+
+    A calendar may be set up again, replacing what it had before, even when
+    it is the only user of the same shared set:
+
+        >>> bethany = registry.add_view('bethany', [holidays])
+        >>> len(bethany), registry.num_shared()
+        (1, 1)
+        >>> registry.remove_view('bethany')
+        >>> registry.num_shared()
+        0
+    """
+
+    def __init__(self, start):
+        self.start = start
+        # content digest -> frozenset of Events
+        self._shared = {}
+        # content digest -> how many calendars use it
+        self._users = {}
+        # the digests of the sets added directly, which we always keep
+        self._kept = set()
+        # name -> (tuple of shared digests, frozenset of private Events)
+        self._views = {}
+
+    def _digest(self, lines):
+        hasher = hashlib.sha1()
+        for line in lines:
+            if not isinstance(line, bytes):
+                line = line.encode('utf-8')
+            hasher.update(line)
+            hasher.update(b'\n')
+        return hasher.hexdigest()
+
+    def _add_lines(self, lines):
+        lines = [line.rstrip('\r\n') for line in lines]
+        digest = self._digest(lines)
+        if digest not in self._shared:
+            self._shared[digest] = frozenset(parse_lines(lines, self.start))
+        return digest
+
+    def _add_file(self, filename):
+        with io.open(filename, encoding='utf-8') as fd:
+            return self._add_lines(fd.readlines())
+
+    def add_lines(self, lines):
+        """Add a shared event set given as lines of text.
+
+        Returns the digest under which it is kept. If we already have a set
+        with the same content, that is reused, and nothing is parsed.
+        """
+        digest = self._add_lines(lines)
+        self._kept.add(digest)
+        return digest
+
+    def add_file(self, filename):
+        """Add a shared event set read from the named file.
+
+        Returns the digest under which it is kept.
+        """
+        digest = self._add_file(filename)
+        self._kept.add(digest)
+        return digest
+
+    def _digest_for(self, source):
+        """'source' may be a filename, or a sequence of lines.
+        """
+        if isinstance(source, (list, tuple)):
+            return self._add_lines(source)
+        else:
+            return self._add_file(source)
+
+    def add_view(self, name, shared=(), private=()):
+        """Set up the calendar called 'name'.
+
+        'shared' is a sequence of sources (filenames, or lists of lines) that
+        may be shared with other calendars, and 'private' is the lines of
+        events that belong to this calendar alone.
+
+        Returns the events for that calendar (see events()).
+        """
+        digests = tuple(self._digest_for(source) for source in shared)
+        if private:
+            private_events = frozenset(parse_lines(private, self.start))
+        else:
+            private_events = frozenset()
+        # Count the new users before forgetting any old view of the same
+        # name, so that the sets both of them use are kept
+        for digest in digests:
+            self._users[digest] = self._users.get(digest, 0) + 1
+        if name in self._views:
+            self.remove_view(name)
+        self._views[name] = (digests, private_events)
+        return self.events(name)
+
+    def remove_view(self, name):
+        """Forget the calendar called 'name', and any shared sets it alone used.
+
+        Shared sets added directly (with add_lines or add_file) are kept.
+        """
+        try:
+            digests, private_events = self._views.pop(name)
+        except KeyError:
+            raise GiveUp('There is no calendar called {!r}'.format(name))
+        for digest in digests:
+            self._users[digest] -= 1
+            if not self._users[digest]:
+                del self._users[digest]
+                if digest not in self._kept:
+                    del self._shared[digest]
+
+    def num_shared(self):
+        """Return how many distinct shared event sets we are holding.
+        """
+        return len(self._shared)
+
+    def events(self, name):
+        """Return a CalendarView of all the events in calendar 'name'.
+
+        This does not copy the events - it just refers to the shared and
+        private sets.
+        """
+        try:
+            digests, private_events = self._views[name]
+        except KeyError:
+            raise GiveUp('There is no calendar called {!r}'.format(name))
+        return CalendarView([private_events] +
+                            [self._shared[digest] for digest in digests])
+
+    def find_events(self, name, start, end, at_words=None):
+        """Return (date, text, event) tuples for calendar 'name'.
+        """
+        return find_events(self.events(name), start, end, at_words)
+
+class CalendarView(object):
+    """The events of one calendar in a CalendarRegistry.
+
+    It may be iterated over as often as needed, each time chaining together
+    the (shared and private) sets of events it refers to.
+    """
+
+    def __init__(self, event_sets):
+        self.event_sets = tuple(event_sets)
+
+    def __iter__(self):
+        return itertools.chain(*self.event_sets)
+
+    def __len__(self):
+        return sum(len(events) for events in self.event_sets)
+
+def _normalise_tags(tags):
+    """Return a set of lower case @<words>, or None if 'tags' is empty.
+    """
+    if not tags:
+        return None
+    if isinstance(tags, str):
+        tags = [tags]
+    return set(tag.lower() for tag in tags)
+
+class Calendar(object):
+    """A simple interface for using events from other Python code.
+
+    For instance:
+
+        >>> start=datetime.date(2013, 10, 1)
+        >>> cal = Calendar(parse_lines(
+        ...     [r':every Thu, @Charles Singing lesson',
+        ...      r'  :except 2013 Oct 3, Doing something else',
+        ...      r':first Tue, @Bethany Ipswich',
+        ...      r'1980* Oct  9, @Birthday: @Alfred is :age, born in :year'],
+        ...     start))
+        >>> for date, text, event in cal.between(start, datetime.date(2013, 10, 10)):
+        ...     print(date, text)
+        2013-10-01 @Bethany Ipswich
+        2013-10-09 @Birthday: @Alfred is 33, born in 1980
+        2013-10-10 @Charles Singing lesson
+        >>> for date, text, event in cal.upcoming(3, after=datetime.date(2014, 9, 30),
+        ...                                       tags=['@alfred', '@bethany']):
+        ...     print(date, text)
+        2014-10-07 @Bethany Ipswich
+        2014-10-09 @Birthday: @Alfred is 34, born in 1980
+        2014-11-04 @Bethany Ipswich
+    """
+
+    def __init__(self, events, cache=None):
+        self.events = frozenset(events)
+        self.cache = cache
+
+    @classmethod
+    def from_file(cls, filename, start=None, cache=None):
+        """Read a Calendar from the named events file.
+
+        Colon dates (':every Thu', and so on) start on or after 'start',
+        which defaults to today.
+        """
+        if start is None:
+            start = datetime.date.today()
+        return cls(read_events(filename, start), cache)
+
+    def _tagged(self, tags):
+        at_words = _normalise_tags(tags)
+        if at_words is None:
+            return self.events
+        return [event for event in self.events
+                if at_words.intersection(event.at_words)]
+
+    def between(self, start, end, tags=None):
+        """Return a sorted list of (date, text, event) from 'start' to 'end'.
+
+        If 'tags' is given, only events with at least one of those @<words>
+        are included.
+        """
+        return sorted(find_events(self.events, start, end,
+                                  _normalise_tags(tags), self.cache))
+
+    def on(self, date, tags=None):
+        """Return a sorted list of (date, text, event) for the given date.
+        """
+        return self.between(date, date, tags)
+
+    def next_occurrence(self, event, after):
+        """Return the first date after 'after' on which 'event' occurs, or None.
+        """
+        return event.next_date(after)
+
+    def previous_occurrence(self, event, before):
+        """Return the last date before 'before' on which 'event' occurs, or None.
+        """
+        return event.previous_date(before)
+
+    def upcoming(self, n, after=None, tags=None):
+        """Return a list of the next 'n' (date, text, event) tuples.
+
+        Only occurrences after 'after' are included. If 'after' is not given,
+        it defaults to yesterday (so today's events are included).
+        """
+        if after is None:
+            after = datetime.date.today() - ONE_DAY
+        return list(itertools.islice(
+            iter_occurrences(self._tagged(tags), after), n))
+
+def iter_occurrences(events, after, at_words=None, where=None):
+    """Yield (date, text, event) tuples in date order, from after 'after'.
+
+    This keeps a heap holding the next occurrence of each event, so only
+    those occurrences that are actually asked for are worked out, however
+    far apart they turn out to be.
+
+    If 'where' is given, it should be an EventFilter, and only the events
+    (and dates) it allows will be yielded.
+    """
+    heap = []
+    for number, event in enumerate(events):
+        if at_words and not at_words.intersection(event.at_words):
+            continue
+        if where is None:
+            mask = ALL_DAYS_MASK
+        else:
+            mask = where.day_mask(event)
+            if not mask:
+                continue
+        date = EventFilter.next_date(event, after, mask)
+        if date is not None:
+            # The number breaks ties, without needing to compare the events
+            heap.append((date, number, event, mask))
+    heapq.heapify(heap)
+    while heap:
+        date, number, event, mask = heap[0]
+        yield date, event.text_for(date), event
+        next_date = EventFilter.next_date(event, date, mask)
+        if next_date is None:
+            heapq.heappop(heap)
+        else:
+            heapq.heapreplace(heap, (next_date, number, event, mask))
+
+class SlidingWindow(object):
+    """The occurrences from 'start' to 'end', kept up to date as they move.
+
+    Something that stays running (and so has to move on to a new "today"
+    each midnight) can move the window, and only the days that have come
+    into it are worked out - the days that have dropped out of it are just
+    forgotten. If the new window doesn't overlap the old one at all, it is
+    worked out afresh.
+
+        >>> start = datetime.date(2013, 10, 1)
+        >>> events = parse_lines([r':every Thu, @Charles Singing lesson',
+        ...                       r'2013 Oct 31 Thu, Halloween'], start)
+        >>> window = SlidingWindow(events, start, datetime.date(2013, 10, 28))
+        >>> len(window.things()), window.days_expanded
+        (4, 28)
+        >>> window.move(datetime.date(2013, 10, 4), datetime.date(2013, 10, 31))
+        >>> for date, text, event in window.things():
+        ...     print(date, text)
+        2013-10-10 @Charles Singing lesson
+        2013-10-17 @Charles Singing lesson
+        2013-10-24 @Charles Singing lesson
+        2013-10-31 @Charles Singing lesson
+        2013-10-31 Halloween
+        >>> window.days_expanded
+        31
+    """
+
+    def __init__(self, events, start, end, at_words=None, where=None):
+        self.events = events
+        self.at_words = at_words
+        self.where = where
+        self.start = start
+        self.end = end
+        self.days_expanded = 0
+        self._days = {}
+        self._expand(start, end)
+
+    def _expand(self, start, end):
+        """Work out the occurrences from 'start' to 'end', and remember them.
+        """
+        for thing in find_events(self.events, start, end, self.at_words,
+                                 where=self.where):
+            self._days.setdefault(thing[0].toordinal(), []).append(thing)
+        self.days_expanded += end.toordinal() - start.toordinal() + 1
+
+    def move(self, start, end):
+        """Move the window to cover 'start' to 'end' instead.
+        """
+        if start > self.end or end < self.start:
+            self._days = {}
+            self._expand(start, end)
+        else:
+            first = start.toordinal()
+            last = end.toordinal()
+            for ordinal in list(self._days):
+                if ordinal < first or ordinal > last:
+                    del self._days[ordinal]
+            if start < self.start:
+                self._expand(start, self.start - ONE_DAY)
+            if end > self.end:
+                self._expand(self.end + ONE_DAY, end)
+        self.start = start
+        self.end = end
+
+    def move_to_today(self, today):
+        """Move the window to the default dates for 'today'.
+
+        Returns the same as determine_dates.
+        """
+        start, yesterday, today, end = determine_dates(today=today)
+        self.move(start, end)
+        return start, yesterday, today, end
+
+    def things(self):
+        """Return the (date, text, event) tuples in the window, sorted.
+        """
+        things = []
+        for ordinal in sorted(self._days):
+            things.extend(sorted(self._days[ordinal], key=occurrence_sort_key))
+        return things
+
+def determine_dates(start=None, today=None, end=None):
+    """Given the three "bounding" dates, validate and expand them.
+
+    Returns actual values for start, yesterday, today, end
+    """
+    if today is None:
+        today = datetime.date.today()
+
+    yesterday = today - datetime.timedelta(days=1)
+
+    if start is None:
         # Use "yesterday"
         start = yesterday
 
@@ -2055,6 +4196,868 @@ def determine_dates(start=None, today=None, end=None):
 
     return start, yesterday, today, end
 
+# -----------------------------------------------------------------------------
+# A precomputed index of the events on each day
+
+# Bump this if the layout of the index file changes
+DAY_INDEX_VERSION = 3
+
+@total_ordering
+class IndexedEvent(object):
+    """Stands in for an Event, for occurrences read from a day index.
+
+    It only knows the event's @<words> and time of day, which is all that
+    the reports need, and (so that two identical occurrences from different
+    events stay distinct) a number identifying the event.
+    """
+
+    def __init__(self, number, at_words, time_span=None):
+        self.number = number
+        self.at_words = frozenset(at_words)
+        self.time_span = time_span
+
+    def __hash__(self):
+        return hash(self.number)
+
+    def __eq__(self, other):
+        return self.number == other.number
+
+    def __lt__(self, other):
+        return self.number < other.number
+
+def day_index_filename(filename):
+    """Return the name of the day index file for the named events file.
+    """
+    return '{}.index'.format(filename)
+
+def file_fingerprint(filename):
+    """Return a fingerprint of the content of the named file.
+    """
+    hasher = hashlib.sha1()
+    with open(filename, 'rb') as fd:
+        for block in iter(lambda: fd.read(65536), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+def as_unicode(text):
+    """Return 'text' as unicode, decoding it as UTF-8 if it is bytes.
+
+    Under Python 2, text read from an events file (or the command line) is
+    bytes, and needs decoding before it can be mixed with unicode.
+    """
+    if isinstance(text, bytes):
+        return text.decode('utf-8')
+    return text
+
+def as_str(text):
+    """Return 'text' as a native str, encoding it as UTF-8 if need be.
+
+    Under Python 2, text read back from JSON or SQLite is unicode, but the
+    rest of what.py works with the same (byte) strings as the events file.
+    """
+    if text is not None and not isinstance(text, str):
+        return text.encode('utf-8')
+    return text
+
+def write_json(filename, data):
+    """Write 'data' to the named file as (ASCII) JSON.
+
+    Sticking to ASCII means the same bytes get written whether the text
+    within 'data' is bytes or unicode, and under Python 2 or 3.
+    """
+    with open(filename, 'wb') as fd:
+        fd.write(json.dumps(data, sort_keys=True).encode('ascii'))
+
+def day_index_span(today, past_days=31, future_months=18):
+    """Return the first and last dates that a day index made 'today' covers.
+
+        >>> first, last = day_index_span(datetime.date(2013, 8, 31))
+        >>> print(first, last)
+        2013-07-31 2015-02-28
+    """
+    return (today - datetime.timedelta(days=past_days),
+            get_n_month_end(future_months, today))
+
+def build_day_index(filename, today, past_days=31, future_months=18):
+    """Write a day index for the named events file.
+
+    The index holds every occurrence from 'past_days' before 'today' until
+    'future_months' after it, keyed by day, so that reports for dates
+    within that horizon need not read (or expand) the events at all.
+
+    The dates of "anchored" events (those using colon dates, such as
+    ':first Sat') depend on the report's 'start' date, so their occurrences
+    are not kept. Instead, the index keeps their lines, and they alone are
+    read (and expanded) afresh for each report, against its own 'start'.
+
+    Returns the first and last dates in the index.
+    """
+    first, last = day_index_span(today, past_days, future_months)
+    events = read_events(filename, today - ONE_DAY)
+
+    numbers = {}
+    anchored = []
+    for event in sorted(events):
+        if event.anchored:
+            numbers[event] = len(numbers)
+            anchored.append([numbers[event],
+                             as_unicode('\n'.join(event.source_lines))])
+
+    days = {}
+    for date, text, event in sorted(find_events(
+            [event for event in events if not event.anchored], first, last)):
+        number = numbers.setdefault(event, len(numbers))
+        days.setdefault(str(date.toordinal()), []).append(
+            [text, number, sorted(event.at_words)])
+
+    index = {'version': DAY_INDEX_VERSION,
+             'fingerprint': file_fingerprint(filename),
+             'first': first.toordinal(),
+             'last': last.toordinal(),
+             'anchored': anchored,
+             'days': days,
+            }
+    write_json(day_index_filename(filename), index)
+    return first, last
+
+def read_day_index(filename, start, end, at_words=None):
+    """Return (date, text, event) tuples from the named file's day index.
+
+    The "events" are IndexedEvent instances.
+
+    The anchored events are parsed again, against 'start', and their
+    occurrences worked out, just as they would be without the index.
+
+    Returns None if there is no index, or it is out of date with respect
+    to the events file, or it does not cover the dates from 'start' to
+    'end', or an anchored event uses ':for <count> workdays' (whose
+    holidays are other events), in which case the events will need to be
+    read in the normal way.
+    """
+    index_filename = day_index_filename(filename)
+    if not os.path.exists(index_filename):
+        return None
+    try:
+        with io.open(index_filename, encoding='utf-8') as fd:
+            index = json.load(fd)
+    except ValueError:
+        return None
+    if (index.get('version') != DAY_INDEX_VERSION or
+            index['fingerprint'] != file_fingerprint(filename)):
+        return None
+    start_ordinal = start.toordinal()
+    end_ordinal = end.toordinal()
+    if start_ordinal < index['first'] or end_ordinal > index['last']:
+        return None
+
+    stand_ins = {}
+    things = set()
+    for number, lines in index['anchored']:
+        lines = as_str(lines).split('\n')
+        event = parse_event(1, lines[0], lines[1:], start)
+        if event.for_workdays is not None:
+            return None
+        event.freeze()
+        if at_words and not at_words.intersection(event.at_words):
+            continue
+        for date, text, event in event.get_dates(start, end):
+            if number not in stand_ins:
+                stand_ins[number] = IndexedEvent(number, event.at_words,
+                                                 event.time_span)
+            things.add((date, text, stand_ins[number]))
+
+    days = index['days']
+    for ordinal in range(start_ordinal, end_ordinal+1):
+        records = days.get(str(ordinal))
+        if not records:
+            continue
+        date = datetime.date.fromordinal(ordinal)
+        for text, number, words in records:
+            if at_words and not at_words.intersection(words):
+                continue
+            text = as_str(text)
+            if number not in stand_ins:
+                stand_ins[number] = IndexedEvent(number, words,
+                                                 parse_time_span(text))
+            things.add((date, text, stand_ins[number]))
+    return things
+
+SEEN_VERSION = 1
+
+def seen_filename(filename):
+    """Return the name of the file remembering what -since-last has reported.
+    """
+    return '{}.seen'.format(filename)
+
+def occurrence_fingerprint(date, text, event):
+    """Return a short fingerprint for an occurrence.
+
+    It depends on the date, the text and the first line of the event (as
+    written in the file), so moving the event or changing how it repeats
+    gives different fingerprints.
+    """
+    hasher = hashlib.sha1()
+    hasher.update(u'{}\0{}\0{}'.format(date.toordinal(), as_unicode(text),
+                                        as_unicode(event.source or u''))
+                  .encode('utf-8'))
+    return hasher.hexdigest()[:16]
+
+class SeenOccurrences(object):
+    """The occurrences already reported by -since-last, kept on disk.
+
+    For each set of @<words> (and -where expression) asked about, we
+    remember the fingerprints of the occurrences reported for each day.
+    Days that have passed are forgotten. If 'filename' is None, nothing
+    is read or saved.
+
+        >>> start = datetime.date(2013, 10, 1)
+        >>> end = datetime.date(2013, 10, 31)
+        >>> events = parse_lines([r':every Thu, @Charles Singing lesson'], start)
+        >>> seen = SeenOccurrences(None, set(['@charles']))
+        >>> len(seen.new_things(find_events(events, start, end)))
+        5
+        >>> seen.remember(find_events(events, start, end), start, end)
+        >>> events = parse_lines([r':every Thu, @Charles Singing lesson',
+        ...                       r'2013 Oct 9 Wed, @Charles Dentist'], start)
+        >>> for date, text, event in seen.new_things(find_events(events, start, end)):
+        ...     print(date, text)
+        2013-10-09 @Charles Dentist
+        >>> seen.save()
+
+    A -where expression is remembered separately from the @<words> alone,
+    since it reports a different set of occurrences:
+
+        >>> print(SeenOccurrences(None, set(['@charles']),
+        ...                       EventFilter('/dentist/')).key)
+        @charles -where /dentist/
+    """
+
+    def __init__(self, filename, at_words, where=None):
+        self.filename = filename
+        key = ' '.join(sorted(at_words))
+        if where is not None:
+            key = '{} -where {}'.format(key, where.text)
+        self.key = as_unicode(key)
+        self.all_days = {}
+        if filename and os.path.exists(filename):
+            try:
+                with io.open(filename, encoding='utf-8') as fd:
+                    data = json.load(fd)
+            except ValueError:
+                data = {}
+            if data.get('version') == SEEN_VERSION:
+                self.all_days = data['seen']
+        self.days = self.all_days.setdefault(self.key, {})
+
+    def new_things(self, things):
+        """Return a sorted list of those 'things' we have not reported before.
+        """
+        fingerprints = {}
+        for thing in things:
+            fingerprints[occurrence_fingerprint(*thing)] = thing
+        seen = set()
+        for day in set(str(thing[0].toordinal()) for thing in things):
+            seen.update(self.days.get(day, ()))
+        return sorted((fingerprints[fingerprint] for fingerprint in
+                       set(fingerprints) - seen), key=occurrence_sort_key)
+
+    def remember(self, things, start, end):
+        """Remember 'things' as the occurrences from 'start' to 'end'.
+
+        Anything we remembered for before 'start' is forgotten.
+        """
+        first = start.toordinal()
+        for days in self.all_days.values():
+            for day in list(days):
+                if int(day) < first:
+                    del days[day]
+        for ordinal in range(first, end.toordinal()+1):
+            self.days.pop(str(ordinal), None)
+        for thing in things:
+            self.days.setdefault(str(thing[0].toordinal()), []).append(
+                occurrence_fingerprint(*thing))
+        for key in list(self.all_days):
+            if not self.all_days[key] and key != self.key:
+                del self.all_days[key]
+
+    def save(self):
+        if self.filename is None:
+            return
+        write_json(self.filename, {'version': SEEN_VERSION,
+                                   'seen': self.all_days})
+
+# -----------------------------------------------------------------------------
+# Exporting to SQLite
+
+SQLITE_SCHEMA = """\
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    fingerprint TEXT UNIQUE NOT NULL,
+    source TEXT,
+    text TEXT NOT NULL,
+    date TEXT NOT NULL,
+    colon_date TEXT,
+    repeat_yearly INTEGER NOT NULL,
+    every_n_days TEXT,
+    nth_of_month TEXT,
+    ordinals TEXT,
+    easter_offset INTEGER,
+    repeat_from TEXT,
+    repeat_until TEXT,
+    weekday_mask INTEGER,
+    excepts TEXT
+);
+CREATE TABLE IF NOT EXISTS event_words (
+    event_id INTEGER NOT NULL REFERENCES events(id),
+    word TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS event_words_word ON event_words(word);
+CREATE INDEX IF NOT EXISTS event_words_event ON event_words(event_id);
+CREATE TABLE IF NOT EXISTS occurrences (
+    event_id INTEGER NOT NULL REFERENCES events(id),
+    date TEXT NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS occurrences_date ON occurrences(date);
+CREATE INDEX IF NOT EXISTS occurrences_event ON occurrences(event_id);
+"""
+
+def event_fingerprint(event):
+    """Return a fingerprint of an event, as the user wrote it.
+
+    Unlike event_identity, this doesn't use the event's actual date, which
+    for something like ':every Thu' depends on when the file was read.
+    """
+    return hashlib.sha1(as_unicode(str(event)).encode('utf-8')).hexdigest()
+
+def _event_row(fingerprint, event):
+    # SQLite wants unicode, but under Python 2 the text is bytes
+    def joined(values):
+        return ','.join(str(value) for value in sorted(values)) or None
+    excepts = '\n'.join(line.strip() for line in event.not_on.condition_lines())
+    return (fingerprint,
+            as_unicode(event.source),
+            as_unicode(event.text),
+            str(event.date),
+            as_unicode(event.colon_date),
+            int(bool(event.repeat_yearly)),
+            joined(event.repeat_every_N_days),
+            joined(event.repeat_on_Nth_of_month),
+            joined('{} {}'.format(ORDINAL[index], day_name)
+                   for index, day_name in event.repeat_ordinal),
+            event.on_Nth_day_of_easter,
+            str(event.repeat_from) if event.repeat_from else None,
+            str(event.repeat_until) if event.repeat_until else None,
+            event.weekday_mask,
+            as_unicode(excepts) or None,
+           )
+
+def _insert_occurrences(cursor, ids_and_events, first, last):
+    """Insert the occurrences from 'first' to 'last' of the given events.
+    """
+    if first > last:
+        return
+    cursor.executemany('INSERT INTO occurrences (event_id, date, text)'
+                       ' VALUES (?, ?, ?)',
+                       ((event_id, str(date), as_unicode(text))
+                        for event_id, event in ids_and_events
+                        for date, text, event in event.get_dates(first, last)))
+
+def export_sqlite(events, db_filename, first, last):
+    """Write the events, and their occurrences from 'first' to 'last', to SQLite.
+
+    If the database already has events in it, only those events whose
+    fingerprint (see event_fingerprint) has changed are removed or added.
+    The occurrences of the events that are still there are only worked
+    out for any days that the horizon has gained.
+
+    Everything is done in a single transaction. Returns a tuple of the
+    number of events (added, removed, unchanged).
+
+        >>> import shutil, sqlite3, tempfile
+        >>> start = datetime.date(2013, 10, 1)
+        >>> end = datetime.date(2013, 10, 31)
+        >>> events = parse_lines([r':every Thu, @Charles Singing lesson',
+        ...                       r':first Tue, @Bethany Ipswich'], start)
+        >>> tempdir = tempfile.mkdtemp()
+        >>> db = os.path.join(tempdir, 'what.db')
+        >>> export_sqlite(events, db, start, end)
+        (2, 0, 0)
+        >>> events = parse_lines([r':every Thu, @Charles Singing lesson',
+        ...                       r':first Tue, @Bethany Ipswich, Suffolk'], start)
+        >>> export_sqlite(events, db, start, end)
+        (1, 1, 1)
+        >>> connection = sqlite3.connect(db)
+        >>> for date, text in connection.execute(
+        ...         "SELECT o.date, o.text FROM occurrences o"
+        ...         " JOIN event_words w ON o.event_id = w.event_id"
+        ...         " WHERE w.word = '@bethany'"):
+        ...     print(date, text)
+        2013-10-01 @Bethany Ipswich, Suffolk
+        >>> connection.close()
+        >>> shutil.rmtree(tempdir)
+    """
+    try:
+        import sqlite3
+    except ImportError:
+        raise GiveUp('Exporting to SQLite needs the sqlite3 module')
+
+    by_fingerprint = dict((event_fingerprint(event), event) for event in events)
+
+    connection = sqlite3.connect(db_filename)
+    try:
+        with connection:
+            cursor = connection.cursor()
+            cursor.executescript(SQLITE_SCHEMA)
+            meta = dict(cursor.execute('SELECT key, value FROM meta'))
+            existing = dict(cursor.execute('SELECT fingerprint, id FROM events'))
+
+            gone = [(existing[fingerprint],) for fingerprint in existing
+                    if fingerprint not in by_fingerprint]
+            cursor.executemany('DELETE FROM occurrences WHERE event_id = ?', gone)
+            cursor.executemany('DELETE FROM event_words WHERE event_id = ?', gone)
+            cursor.executemany('DELETE FROM events WHERE id = ?', gone)
+
+            # The events we already have need their occurrences moving to
+            # the new horizon
+            kept = [(existing[fingerprint], event)
+                    for fingerprint, event in by_fingerprint.items()
+                    if fingerprint in existing]
+            if 'first' in meta and kept:
+                old_first = datetime.date.fromordinal(int(meta['first']))
+                old_last = datetime.date.fromordinal(int(meta['last']))
+                cursor.execute('DELETE FROM occurrences WHERE date < ? OR date > ?',
+                               (str(first), str(last)))
+                if old_last < first or last < old_first:
+                    _insert_occurrences(cursor, kept, first, last)
+                else:
+                    _insert_occurrences(cursor, kept, first,
+                                        min(last, old_first - ONE_DAY))
+                    _insert_occurrences(cursor, kept,
+                                        max(first, old_last + ONE_DAY), last)
+
+            added = []
+            for fingerprint, event in by_fingerprint.items():
+                if fingerprint not in existing:
+                    cursor.execute('INSERT INTO events (fingerprint, source, text,'
+                                   ' date, colon_date, repeat_yearly, every_n_days,'
+                                   ' nth_of_month, ordinals, easter_offset,'
+                                   ' repeat_from, repeat_until, weekday_mask,'
+                                   ' excepts) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?,'
+                                   ' ?, ?, ?, ?, ?)',
+                                   _event_row(fingerprint, event))
+                    added.append((cursor.lastrowid, event))
+            cursor.executemany('INSERT INTO event_words (event_id, word)'
+                               ' VALUES (?, ?)',
+                               ((event_id, as_unicode(word))
+                                for event_id, event in added
+                                for word in sorted(event.at_words)))
+            _insert_occurrences(cursor, added, first, last)
+
+            cursor.executemany('INSERT OR REPLACE INTO meta (key, value)'
+                               ' VALUES (?, ?)',
+                               [('first', str(first.toordinal())),
+                                ('last', str(last.toordinal()))])
+    finally:
+        connection.close()
+    return len(added), len(gone), len(kept)
+
+# -----------------------------------------------------------------------------
+# Keeping events in SQLite, instead of a text file
+
+# Files with these extensions are taken to be EventStores
+EVENT_STORE_EXTENSIONS = ('.db', '.sqlite', '.sqlite3')
+
+EVENT_STORE_VERSION = 2
+
+EVENT_STORE_SCHEMA = """\
+CREATE TABLE IF NOT EXISTS store_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS store_events (
+    id INTEGER PRIMARY KEY,
+    first_active INTEGER NOT NULL,
+    last_active INTEGER NOT NULL,
+    date INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    source TEXT,
+    colon_date TEXT,
+    repeat_yearly INTEGER NOT NULL,
+    every_n_days TEXT NOT NULL,
+    nth_of_month TEXT NOT NULL,
+    easter_offset INTEGER,
+    repeat_from INTEGER,
+    repeat_until INTEGER,
+    ordinals TEXT NOT NULL,
+    excepts TEXT NOT NULL,
+    weekday_mask INTEGER,
+    lines TEXT
+);
+CREATE INDEX IF NOT EXISTS store_events_first ON store_events(first_active);
+CREATE INDEX IF NOT EXISTS store_events_last ON store_events(last_active);
+CREATE TABLE IF NOT EXISTS store_words (
+    event_id INTEGER NOT NULL REFERENCES store_events(id),
+    word TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS store_words_word ON store_words(word, event_id);
+"""
+
+def event_active_span(event):
+    """Return the first and last day ordinals on which 'event' might occur.
+
+        >>> start = datetime.date(2013, 10, 1)
+        >>> event = parse_lines([r'2013 Oct 3 Thu, Lesson',
+        ...                      r'  :every 7 days',
+        ...                      r'  :until 2013 Dec 19'], start).pop()
+        >>> [str(datetime.date.fromordinal(n)) for n in event_active_span(event)]
+        ['2013-10-03', '2013-12-19']
+
+    An anchored event is read again for each report, and then might occur
+    on any day at all.
+    """
+    if event.anchored:
+        return datetime.date.min.toordinal(), datetime.date.max.toordinal()
+    if event.repeat_from:
+        first = event.repeat_from.toordinal()
+    elif event.repeat_yearly:
+        # We repeat in earlier years as well as later ones
+        first = datetime.date.min.toordinal()
+    else:
+        first = event.date.toordinal()
+    if event.repeat_until:
+        last = event.repeat_until.toordinal()
+    elif event.repeats():
+        last = datetime.date.max.toordinal()
+    else:
+        last = event.date.toordinal()
+    return first, last
+
+def _needs_parsing(event):
+    """Return True if 'event' must be parsed again for each new 'start'.
+
+    That is so for an anchored event whose conditions depend on its date,
+    or that is anchored by something other than its own colon date (a
+    colon date in a condition, or holidays that are themselves anchored).
+    Any other anchored event just needs its colon date working out again.
+    """
+    if not event.anchored or not event.source_lines:
+        return False
+    if event.colon_date is None:
+        return True
+    for line in event.source_lines[1:]:
+        words = line.split()
+        if words[0].lower() in (':for', ':monthly'):
+            return True
+        if any(word.startswith(':') for word in words[1:]):
+            return True
+    return False
+
+def _resolve_colon_date(colon_date, start):
+    """Return the date that a colon date (':first Sat', etc.) gives for 'start'.
+    """
+    words = colon_date.split()
+    colon_word = words[0].lower()
+    return colon_event_methods[colon_word](colon_word, words[1:], start).date
+
+class EventStore(object):
+    """Events kept in an SQLite database, rather than a text file.
+
+    Each event's rules are kept as separate fields (in the same form as
+    event_to_record uses), along with the first and last days it might
+    occur on, and its @<words>, all of which are indexed. So the events
+    for a report are found by one indexed query, and nothing needs parsing.
+
+    Anchored events (those using ':first Sat', ':easter' and so on) have
+    dates that depend on the 'start' they were read with. For most of
+    them, only their own date does, and that is worked out again from the
+    colon date, against the 'start' asked for, each time they are read.
+    The few whose conditions also depend on their date (':for', ':monthly',
+    or a colon date inside a condition) have their lines kept as well, and
+    are parsed again. Either way, the store gives the same dates as the
+    events file would.
+
+        >>> import shutil, tempfile
+        >>> tempdir = tempfile.mkdtemp()
+        >>> start = datetime.date(1900, 1, 1)
+        >>> events = parse_lines(
+        ...     [r':every Thu, @Charles Singing lesson',
+        ...      r'  :except 2013 Oct 10',
+        ...      r'2013 Oct 25 Fri, Craft Fair',
+        ...      r'2013 Nov 5 Tue, @Alfred Fireworks'], start)
+        >>> store = EventStore(os.path.join(tempdir, 'what.db'))
+        >>> store.save(events)
+        >>> sorted(store.events()) == sorted(events)
+        True
+        >>> for event in sorted(store.events(datetime.date(2013, 10, 1),
+        ...                                  datetime.date(2013, 10, 31))):
+        ...     print(event)
+        :every Thu, @Charles Singing lesson
+          :every Thu
+          :except 2013 Oct 10 Thu
+        2013 Oct 25 Fri, Craft Fair
+        >>> store.save(parse_lines(
+        ...     [r':every Thu, 17:00 @Charles Singing lesson',
+        ...      r'  :until 2013 Nov 21',
+        ...      r':first Tue, @Bethany Ipswich',
+        ...      r':easter Fri, @pubhol Good Friday',
+        ...      r'1980* Oct 9, @Birthday: @Alfred is :age',
+        ...      r':first Sat, Weekend away',
+        ...      r'  :for 3 days'], start))
+        >>> store.connection.execute(
+        ...     'SELECT COUNT(*), COUNT(lines) FROM store_events').fetchone()
+        (5, 1)
+        >>> november = find_events(store.events(datetime.date(2013, 11, 1)),
+        ...                        datetime.date(2013, 11, 1),
+        ...                        datetime.date(2013, 11, 30))
+        >>> for date, text, event in sorted(november):
+        ...     print(date, text)
+        2013-11-02 Weekend away
+        2013-11-03 Weekend away
+        2013-11-04 Weekend away
+        2013-11-05 @Bethany Ipswich
+        2013-11-07 17:00 @Charles Singing lesson
+        2013-11-14 17:00 @Charles Singing lesson
+        2013-11-21 17:00 @Charles Singing lesson
+        >>> store.close()
+        >>> shutil.rmtree(tempdir)
+    """
+
+    def __init__(self, filename):
+        try:
+            import sqlite3
+        except ImportError:
+            raise GiveUp('Using {!r} needs the sqlite3 module'.format(filename))
+        self.filename = filename
+        self.connection = sqlite3.connect(filename)
+        with self.connection:
+            self.connection.executescript(EVENT_STORE_SCHEMA)
+            version = self.connection.execute(
+                "SELECT value FROM store_meta WHERE key = 'version'").fetchone()
+            if version is None:
+                self.connection.execute(
+                    "INSERT INTO store_meta (key, value) VALUES ('version', ?)",
+                    (str(EVENT_STORE_VERSION),))
+            elif int(version[0]) != EVENT_STORE_VERSION:
+                raise GiveUp('{!r} is an event store of version {}, not'
+                             ' {}'.format(filename, version[0], EVENT_STORE_VERSION))
+
+    def close(self):
+        self.connection.close()
+
+    def save(self, events):
+        """Replace the content of the store with 'events'.
+        """
+        # SQLite wants unicode, but under Python 2 the text is bytes
+        rows = []
+        words = []
+        for number, event in enumerate(events, 1):
+            (date, text, colon_date, yearly, every_N_days, Nth_of_month,
+             Nth_day_of_easter, repeat_from, repeat_until, ordinal, not_on,
+             weekday_mask) = event_to_record(event)
+            first, last = event_active_span(event)
+            if _needs_parsing(event):
+                lines = as_unicode('\n'.join(event.source_lines))
+            else:
+                lines = None
+            rows.append((number, first, last, date, as_unicode(text),
+                         as_unicode(event.source), as_unicode(colon_date),
+                         int(bool(yearly)),
+                         json.dumps(every_N_days), json.dumps(Nth_of_month),
+                         Nth_day_of_easter, repeat_from, repeat_until,
+                         json.dumps(ordinal), json.dumps(not_on), weekday_mask,
+                         lines))
+            words.extend((number, as_unicode(word))
+                         for word in sorted(event.at_words))
+        with self.connection:
+            self.connection.execute('DELETE FROM store_words')
+            self.connection.execute('DELETE FROM store_events')
+            self.connection.executemany('INSERT INTO store_events VALUES'
+                                        ' (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?,'
+                                        ' ?, ?, ?, ?, ?, ?)', rows)
+            self.connection.executemany('INSERT INTO store_words VALUES'
+                                        ' (?, ?)', words)
+
+    def events(self, start=None, end=None, at_words=None):
+        """Return the set of events that might occur from 'start' to 'end'.
+
+        If 'at_words' is given, only events with at least one of them are
+        returned. Anchored events are parsed again against 'start' (if it is
+        not given, they are returned as they were when saved).
+        """
+        query = ['SELECT id, date, text, colon_date, repeat_yearly,'
+                 ' every_n_days, nth_of_month, easter_offset, repeat_from,'
+                 ' repeat_until, ordinals, excepts, weekday_mask, source,'
+                 ' lines FROM store_events WHERE 1']
+        values = []
+        if end is not None:
+            query.append('AND first_active <= ?')
+            values.append(end.toordinal())
+        if start is not None:
+            query.append('AND last_active >= ?')
+            values.append(start.toordinal())
+        if at_words:
+            at_words = sorted(as_unicode(word) for word in at_words)
+            query.append('AND id IN (SELECT event_id FROM store_words WHERE'
+                         ' word IN ({}))'.format(', '.join('?' * len(at_words))))
+            values.extend(at_words)
+
+        events, parsed = self._read_rows(
+            self.connection.execute(' '.join(query), values), start)
+        if any(event.for_workdays is not None for event in parsed.values()):
+            # The holidays for ':for <count> workdays' may be any of the other
+            # events, so we need all of them to work out the working days
+            others, others_parsed = self._read_rows(
+                self.connection.execute(query[0]), start)
+            others_parsed.update(parsed)
+            resolve_workdays(list(others) + list(others_parsed.values()))
+        for event in parsed.values():
+            event.freeze()
+            events.add(event)
+        return events
+
+    def _read_rows(self, rows, start):
+        """Turn rows from store_events into events.
+
+        Returns a set of the (frozen) events that could be used as they
+        were, and a dictionary of the anchored events that had to be parsed
+        again, keyed by their row id. The latter are not yet frozen, since
+        they may still need resolve_workdays.
+        """
+        events = set()
+        parsed = {}
+        for row in rows:
+            (number, date, text, colon_date, yearly, every_N_days,
+             Nth_of_month, Nth_day_of_easter, repeat_from, repeat_until,
+             ordinal, not_on, weekday_mask, source, lines) = row
+            if start is not None:
+                if lines is not None:
+                    lines = as_str(lines).split('\n')
+                    parsed[number] = parse_event(1, lines[0], lines[1:], start)
+                    continue
+                elif colon_date is not None:
+                    date = _resolve_colon_date(as_str(colon_date), start).toordinal()
+            record = (date, as_str(text), as_str(colon_date), bool(yearly),
+                      json.loads(every_N_days), json.loads(Nth_of_month),
+                      Nth_day_of_easter, repeat_from, repeat_until,
+                      [tuple(pair) for pair in json.loads(ordinal)],
+                      [(first, last, as_str(reason))
+                       for first, last, reason in json.loads(not_on)],
+                      weekday_mask)
+            events.add(event_from_record(record, as_str(source)))
+        return events, parsed
+
+# -----------------------------------------------------------------------------
+# Exporting occurrences, however many there are
+
+# How many occurrences -export holds in memory before writing some out
+DEFAULT_EXPORT_BUDGET = 200000
+
+def _export_key(date, text, event):
+    """Return a sortable key for an occurrence, in the same order as
+    occurrence_sort_key, made only of numbers and a (unicode) string.
+
+    The text is always unicode, so that keys held in memory sort the same
+    way as those read back from a run file, even under Python 2.
+    """
+    span = event.time_span
+    if span is None:
+        return (date.toordinal(), 0, 0, 0, as_unicode(text))
+    else:
+        return (date.toordinal(), 1, span[0], span[1], as_unicode(text))
+
+def _write_run(keys):
+    """Write sorted occurrence keys to a temporary file, and return its name.
+    """
+    fd, filename = tempfile.mkstemp(prefix='what-', suffix='.run')
+    os.close(fd)
+    with io.open(filename, 'w', encoding='utf-8') as run:
+        for key in keys:
+            run.write(u'{}\t{}\t{}\t{}\t{}\n'.format(*key))
+    return filename
+
+def _read_run(filename):
+    """Yield the occurrence keys from a file written by _write_run.
+    """
+    with io.open(filename, encoding='utf-8') as run:
+        for line in run:
+            ordinal, timed, begin, end, text = line.rstrip('\n').split('\t', 4)
+            yield (int(ordinal), int(timed), int(begin), int(end), text)
+
+def export_occurrences(events, start, end, fd, at_words=None, where=None,
+                       budget=DEFAULT_EXPORT_BUDGET):
+    """Write each occurrence from 'start' to 'end' to 'fd', in order.
+
+    Each line is <yyyy-mm-dd><tab><text>, written as unicode, so 'fd' should
+    be a text file (as from io.open). At most 'budget' occurrences are
+    held in memory: events are expanded a year at a time, and whenever
+    'budget' occurrences have built up they are sorted and written out to
+    a temporary file. The output is then a merge of those files, so it
+    doesn't matter how many years are asked for.
+
+    Returns how many occurrences were written.
+
+        >>> start = datetime.date(2013, 10, 1)
+        >>> events = parse_lines(
+        ...     [r':every Thu, 17:00 @Charles Singing lesson',
+        ...      r'2013 Oct 10 Thu, @Charles Library day',
+        ...      r':first Tue, @Bethany Ipswich'], start)
+        >>> out = io.StringIO()
+        >>> export_occurrences(events, start, datetime.date(2013, 10, 31), out,
+        ...                    budget=2)
+        7
+        >>> print(out.getvalue().strip().replace('\\t', ' | '))
+        2013-10-01 | @Bethany Ipswich
+        2013-10-03 | 17:00 @Charles Singing lesson
+        2013-10-10 | @Charles Library day
+        2013-10-10 | 17:00 @Charles Singing lesson
+        2013-10-17 | 17:00 @Charles Singing lesson
+        2013-10-24 | 17:00 @Charles Singing lesson
+        2013-10-31 | 17:00 @Charles Singing lesson
+    """
+    sharing = {}
+    for event in events:
+        if at_words and not at_words.intersection(event.at_words):
+            continue
+        mask = where.day_mask(event) if where is not None else ALL_DAYS_MASK
+        if mask:
+            sharing.setdefault((rule_signature(event), mask), []).append(event)
+
+    runs = []
+    keys = []
+    try:
+        for (signature, mask), these in sharing.items():
+            first = start
+            while first <= end:
+                last = min(end, datetime.date(first.year, 12, 31))
+                if where is None:
+                    dates = these[0].occurrence_dates(first, last)
+                else:
+                    dates = where.occurrence_dates(these[0], first, last, mask)
+                for event in these:
+                    for date in dates:
+                        keys.append(_export_key(date, event.text_for(date), event))
+                        if len(keys) >= budget:
+                            keys.sort()
+                            runs.append(_write_run(keys))
+                            keys = []
+                first = last + ONE_DAY
+
+        keys.sort()
+        count = 0
+        for ordinal, timed, begin, finish, text in heapq.merge(
+                keys, *[_read_run(run) for run in runs]):
+            fd.write(u'{}\t{}\n'.format(datetime.date.fromordinal(ordinal), text))
+            count += 1
+        return count
+    finally:
+        for run in runs:
+            os.remove(run)
+
 def edit_file(filename, editor):
     if editor is None:
         if sys.platform == 'win32':
@@ -2087,20 +5090,57 @@ def report_atwords(events, filename):
         else:
             print(format2.format(name, times, '' if times==1 else 's'))
 
+def count_atword_days(events, at_words, start, end):
+    """Count how many days from 'start' to 'end' each of the at-words occur on.
+
+    Returns a dictionary of {at-word: count}. Each event contributes the
+    number of days it occurs on to each of its at-words, as worked out
+    by Event.count_dates, so the dates themselves need not be generated.
+
+        >>> start=datetime.date(2013, 10, 1)
+        >>> events = parse_lines(
+        ...     [r':every Thu, @Charles Singing lesson',
+        ...      r'  :except 2013 Oct 3, Doing something else',
+        ...      r':first Tue, @Bethany @Charles Ipswich'], start)
+        >>> sorted(count_atword_days(events, set(['@charles', '@bethany']),
+        ...                          start, datetime.date(2018, 9, 30)).items())
+        [('@bethany', 60), ('@charles', 320)]
+    """
+    count = {}
+    for word in at_words:
+        count[word] = 0
+    for event in events:
+        words = at_words.intersection(event.at_words)
+        if not words:
+            continue
+        days = event.count_dates(start, end)
+        for word in words:
+            count[word] += days
+    return count
+
 def report_atword_days(things, at_words, start, end):
     """Report on how many days in 'things' have which at-words.
     """
-    length = 0
-    for word in at_words:
-        if len(word) > length:
-            length = len(word)
     count = {}
     for word in at_words:
         count[word] = 0
-    for date, text, event in sorted(things):
+    if isinstance(things, OccurrenceTable):
+        dates_and_events = things.dates_and_events()
+    else:
+        dates_and_events = ((date, event) for date, text, event in things)
+    for date, event in dates_and_events:
         for word in at_words:
             if word in event.at_words:
                 count[word] += 1
+    report_atword_counts(count, start, end)
+
+def report_atword_counts(count, start, end):
+    """Report on how many days each at-word occurs, given a count for each.
+    """
+    length = 0
+    for word in count:
+        if len(word) > length:
+            length = len(word)
     # Is this really the best way to do this?
     format = '{{:{}s}} occurs on {{}} day{{}} within {{}} .. {{}}'.format(length)
     keys = sorted(count.keys())
@@ -2109,6 +5149,485 @@ def report_atword_days(things, at_words, start, end):
         print(format.format(word, value, '' if value==1 else 's',
                             start, end))
 
+def occurrence_sort_key(thing):
+    """Sort (date, text, event) tuples by date, and then by time of day.
+
+    Occurrences without a time come first in their day.
+    """
+    date, text, event = thing
+    span = event.time_span
+    return (date, span is not None, span or (0, 0), text, event)
+
+def find_conflicts(things):
+    """Find the occurrences that overlap in time, for each @<word>.
+
+    Returns a sorted list of (at_word, first, second) tuples, where 'first'
+    and 'second' are (date, text, event) tuples, and 'first' starts no
+    later than 'second'. Occurrences without a time of day are ignored.
+
+    This sorts each @<word>'s occurrences by when they start, and then
+    sweeps along them, keeping a heap of those still going on, so it takes
+    O(n log n) time (plus the number of conflicts found).
+
+        >>> start = datetime.date(2013, 10, 1)
+        >>> events = parse_lines(
+        ...     [r':every Thu, 17:00 @Charles Singing lesson',
+        ...      r'2013 Oct 10 Thu, 16:30..17:30 @Charles @Bethany Dentist',
+        ...      r'2013 Oct 10 Thu, 17:30 @Bethany Shopping',
+        ...      r'2013 Oct 10 Thu, @Charles Library day'], start)
+        >>> things = find_events(events, start, datetime.date(2013, 10, 31))
+        >>> for word, first, second in find_conflicts(things):
+        ...     print(word, first[0], first[1], '/', second[1])
+        @charles 2013-10-10 16:30..17:30 @Charles @Bethany Dentist / 17:00 @Charles Singing lesson
+    """
+    intervals = {}
+    for thing in things:
+        span = thing[2].time_span
+        if span is None:
+            continue
+        base = thing[0].toordinal() * MINUTES_PER_DAY
+        for word in thing[2].at_words:
+            intervals.setdefault(word, []).append(
+                (base + span[0], base + span[1], thing))
+
+    conflicts = []
+    for word, spans in intervals.items():
+        spans.sort(key=lambda span: (span[0], span[1],
+                                     occurrence_sort_key(span[2])))
+        ongoing = []            # a heap of (end, index into spans)
+        for index, (begin, finish, thing) in enumerate(spans):
+            while ongoing and ongoing[0][0] <= begin:
+                heapq.heappop(ongoing)
+            for end, other in ongoing:
+                conflicts.append((word, spans[other][2], thing))
+            heapq.heappush(ongoing, (finish, index))
+    conflicts.sort(key=lambda conflict: (conflict[0],
+                                         occurrence_sort_key(conflict[1]),
+                                         occurrence_sort_key(conflict[2])))
+    return conflicts
+
+def report_conflicts(things):
+    """Report on the occurrences that overlap, for each @<word>.
+    """
+    conflicts = find_conflicts(things)
+    for word, first, second in conflicts:
+        date = first[0]
+        print(' {:3} {:2} {:3} {:4}, {}: {} {} / {} {}'.format(
+            DAYS[date.weekday()], date.day, MONTH_NAME[date.month], date.year,
+            word, format_time_span(first[2].time_span), first[1],
+            format_time_span(second[2].time_span), second[1]))
+    print('{} conflict{}'.format(len(conflicts),
+                                 '' if len(conflicts) == 1 else 's'))
+
+def _union_of_intervals(intervals):
+    """Merge sorted (begin, end) intervals, yielding those that don't overlap.
+    """
+    current = None
+    for begin, end in intervals:
+        if current is None:
+            current = [begin, end]
+        elif begin <= current[1]:
+            current[1] = max(current[1], end)
+        else:
+            yield tuple(current)
+            current = [begin, end]
+    if current is not None:
+        yield tuple(current)
+
+def find_free_slots(things, start, end, working_hours=(9*60, 17*60)):
+    """Yield (date, from, to) for the times no-one is busy, on working days.
+
+    'things' are (date, text, event) tuples for everyone of interest, and
+    'working_hours' is the (from, to) minutes after midnight that count.
+    An occurrence with a time span is busy for that span, and one without
+    is busy for the whole day. Only Monday to Friday are considered.
+
+    The busy times are merged (as a stream) into non-overlapping intervals,
+    and then we walk along those and the days together, just the once.
+
+        >>> start = datetime.date(2013, 10, 1)
+        >>> events = parse_lines(
+        ...     [r':every Thu, 10:00..12:00 @Alfred Meeting',
+        ...      r':every Thu, 11:30..13:00 @Bethany Lunch',
+        ...      r'2013 Oct 11 Fri, @Bethany Day off'], start)
+        >>> things = find_events(events, start, datetime.date(2013, 10, 31))
+        >>> for date, begin, end in find_free_slots(things,
+        ...                                         datetime.date(2013, 10, 10),
+        ...                                         datetime.date(2013, 10, 14)):
+        ...     print(date, format_time_span((begin, end)))
+        2013-10-10 9:00..10:00
+        2013-10-10 13:00..17:00
+        2013-10-14 9:00..17:00
+    """
+    intervals = []
+    for date, text, event in things:
+        base = date.toordinal() * MINUTES_PER_DAY
+        span = event.time_span
+        if span is None:
+            intervals.append((base, base + MINUTES_PER_DAY))
+        else:
+            intervals.append((base + span[0], base + span[1]))
+    intervals.sort()
+    busy = _union_of_intervals(intervals)
+
+    day_start, day_end = working_hours
+    current = next(busy, None)
+    for ordinal in range(start.toordinal(), end.toordinal()+1):
+        date = datetime.date.fromordinal(ordinal)
+        if date.weekday() > 4:
+            continue
+        base = ordinal * MINUTES_PER_DAY
+        free_from = base + day_start
+        free_until = base + day_end
+        while current is not None and current[0] < free_until:
+            if current[1] > free_from:
+                if current[0] > free_from:
+                    yield (date, free_from - base, current[0] - base)
+                free_from = current[1]
+            if current[1] > free_until:
+                # Still busy at the end of the day, and maybe beyond
+                break
+            current = next(busy, None)
+        if free_from < free_until:
+            yield (date, free_from - base, free_until - base)
+
+def report_free_slots(things, at_words, start, end, working_hours):
+    """Report on the times when none of 'at_words' are busy.
+    """
+    count = 0
+    for date, begin, finish in find_free_slots(things, start, end, working_hours):
+        length = finish - begin
+        print(' {:3} {:2} {:3} {:4}, {:11} ({}h{:02}m)'.format(
+            DAYS[date.weekday()], date.day, MONTH_NAME[date.month], date.year,
+            format_time_span((begin, finish)), length//60, length%60))
+        count += 1
+    print('{} free slot{} for {}'.format(count, '' if count == 1 else 's',
+                                         ', '.join(sorted(at_words))))
+
+def _count_by_day(offsets, num_days):
+    """Return how many times each day offset occurs in 'offsets', as a list.
+
+    Uses NumPy if it is available, and plain Python if not.
+    """
+    try:
+        import numpy
+    except ImportError:
+        counts = array.array('i', [0]) * num_days
+        for offset in offsets:
+            counts[offset] += 1
+        return counts.tolist()
+    if not offsets:
+        return [0] * num_days
+    return numpy.bincount(numpy.frombuffer(offsets, dtype=numpy.intc),
+                          minlength=num_days).tolist()
+
+def gather_stats(events, start, end, at_words=None, where=None, top=10):
+    """Work out statistics about the occurrences from 'start' to 'end'.
+
+    This goes through each event's dates just the once, without working
+    out their texts (let alone formatting a report), remembering only which
+    day each occurrence falls on and adding up the totals for each @<word>
+    and each kind of repetition (see EVENT_KINDS). The per-day counts are
+    then summed into weeks and months, and a heap picks out the 'top'
+    busiest days.
+
+    Returns a dictionary, suitable for writing out as JSON.
+
+        >>> start = datetime.date(2013, 10, 1)
+        >>> events = parse_lines(
+        ...     [r':every Thu, @Charles Singing lesson',
+        ...      r':first Tue, @Bethany @Charles Ipswich',
+        ...      r'2013 Oct 17 Thu, @Charles Dentist'], start)
+        >>> stats = gather_stats(events, start, datetime.date(2013, 10, 31), top=2)
+        >>> stats['total'], sorted(stats['per_word'].items())
+        (7, [('@bethany', 1), ('@charles', 7)])
+        >>> sorted(stats['per_kind'].items())
+        [('every', 5), ('once', 1), ('ordinal', 1)]
+        >>> stats['busiest_days']
+        [['2013-10-17', 2], ['2013-10-01', 1]]
+        >>> stats['per_month']
+        [['2013-10', 7]]
+    """
+    first = start.toordinal()
+    num_days = end.toordinal() - first + 1
+    offsets = array.array('i')
+    per_word = {}
+    per_kind = {}
+    for event in events:
+        if at_words and not at_words.intersection(event.at_words):
+            continue
+        if where is None:
+            dates = event.occurrence_dates(start, end)
+        else:
+            mask = where.day_mask(event)
+            if not mask:
+                continue
+            dates = where.occurrence_dates(event, start, end, mask)
+        if not dates:
+            continue
+        offsets.extend(date.toordinal() - first for date in dates)
+        for word in event.at_words:
+            per_word[word] = per_word.get(word, 0) + len(dates)
+        kind = '+'.join(sorted(event_kinds(event)))
+        per_kind[kind] = per_kind.get(kind, 0) + len(dates)
+
+    counts = _count_by_day(offsets, num_days)
+
+    per_week = collections.OrderedDict()
+    per_month = collections.OrderedDict()
+    for offset, count in enumerate(counts):
+        date = datetime.date.fromordinal(first + offset)
+        iso_year, week_number, weekday = date.isocalendar()
+        week = '{}-W{:02}'.format(iso_year, week_number)
+        month = '{}-{:02}'.format(date.year, date.month)
+        per_week[week] = per_week.get(week, 0) + count
+        per_month[month] = per_month.get(month, 0) + count
+
+    busiest = heapq.nlargest(top, (offset for offset in range(num_days)
+                                   if counts[offset]),
+                             key=lambda offset: (counts[offset], -offset))
+
+    return {'start': str(start),
+            'end': str(end),
+            'total': len(offsets),
+            'days_with_events': sum(1 for count in counts if count),
+            'per_week': [[week, count] for week, count in per_week.items()],
+            'per_month': [[month, count] for month, count in per_month.items()],
+            'busiest_days': [[str(datetime.date.fromordinal(first + offset)),
+                              counts[offset]] for offset in busiest],
+            'per_word': per_word,
+            'per_kind': per_kind,
+           }
+
+def _histogram_lines(pairs, width=50):
+    most = max([count for label, count in pairs] or [0])
+    lines = []
+    for label, count in pairs:
+        bar = '#' * (count * width // most) if most else ''
+        lines.append('  {:8} {:5} {}'.format(label, count, bar))
+    return lines
+
+def report_stats(stats, as_json=False, paginate=True):
+    """Report the statistics from gather_stats, as text or JSON.
+    """
+    if as_json:
+        print(json.dumps(stats, indent=2, sort_keys=True))
+        return
+    lines = ['{} occurrences on {} days, {} .. {}'.format(stats['total'],
+                stats['days_with_events'], stats['start'], stats['end'])]
+    lines.append('\nBy month:')
+    lines.extend(_histogram_lines(stats['per_month']))
+    lines.append('\nBy week:')
+    lines.extend(_histogram_lines(stats['per_week']))
+    lines.append('\nBusiest days:')
+    for date, count in stats['busiest_days']:
+        lines.append('  {} {:5}'.format(date, count))
+    lines.append('\nBy @<word>:')
+    for word, count in sorted(stats['per_word'].items(),
+                              key=lambda item: (-item[1], item[0])):
+        lines.append('  {:20} {:5}'.format(word, count))
+    lines.append('\nBy kind of repetition:')
+    for kind, count in sorted(stats['per_kind'].items(),
+                              key=lambda item: (-item[1], item[0])):
+        lines.append('  {:20} {:5}'.format(kind, count))
+    if paginate:
+        page('\n'.join(lines))
+    else:
+        print('\n'.join(lines))
+
+def event_identity(event):
+    """Return a key identifying an event by what it says, not where it was.
+
+    Two events with the same identity (perhaps from different versions of
+    the same file) occur on the same dates with the same texts.
+    """
+    return (str(event), event.date)
+
+def diff_events(old_events, new_events, start, end, where=None):
+    """Find the occurrences added and removed between two versions of events.
+
+    Events are matched by their event_identity, and only those in one
+    version but not the other have their dates worked out, so the work done
+    depends on how much has changed, not on how many events there are.
+    An occurrence that an old event and a new event share (for instance,
+    when only an ':except' was added) is neither added nor removed.
+
+    If 'where' is given, it should be an EventFilter, and only the
+    occurrences it allows are compared.
+
+    Returns two sorted lists of (date, text) tuples, (removed, added).
+
+        >>> start = datetime.date(2013, 10, 1)
+        >>> old = parse_lines([r':every Thu, @Charles Singing lesson',
+        ...                    r':first Tue, @Bethany Ipswich'], start)
+        >>> new = parse_lines([r':every Thu, @Charles Singing lesson',
+        ...                    r':first Tue, @Bethany Ipswich',
+        ...                    r'  :except 2013 Nov 5',
+        ...                    r'2013 Nov 6, @Bethany Ipswich (moved)'], start)
+        >>> removed, added = diff_events(old, new, start, datetime.date(2013, 12, 31))
+        >>> removed
+        [(datetime.date(2013, 11, 5), '@Bethany Ipswich')]
+        >>> added
+        [(datetime.date(2013, 11, 6), '@Bethany Ipswich (moved)')]
+    """
+    old_by_key = dict((event_identity(event), event) for event in old_events)
+    new_by_key = dict((event_identity(event), event) for event in new_events)
+
+    def occurrences(by_key, other):
+        changed = [event for key, event in by_key.items() if key not in other]
+        found = collections.Counter()
+        for event, dates in _event_dates(changed, start, end, where=where):
+            found.update((date, event.text_for(date)) for date in dates)
+        return found
+
+    was = occurrences(old_by_key, new_by_key)
+    now = occurrences(new_by_key, old_by_key)
+    removed = sorted((was - now).elements())
+    added = sorted((now - was).elements())
+    return removed, added
+
+def report_diff(removed, added):
+    """Report on the occurrences from diff_events.
+    """
+    changes = [(date, '-', text) for date, text in removed]
+    changes.extend((date, '+', text) for date, text in added)
+    for date, sign, text in sorted(changes):
+        print('{} {:3} {:2} {:3} {:4}, {}'.format(sign, DAYS[date.weekday()],
+            date.day, MONTH_NAME[date.month], date.year, text))
+    print('{} occurrence{} removed, {} added'.format(len(removed),
+        '' if len(removed) == 1 else 's', len(added)))
+
+def describe_rules(event):
+    """Return a short description of how 'event' repeats.
+
+        >>> start = datetime.date(2013, 10, 1)
+        >>> for event in sorted(parse_lines(
+        ...         [r':every Thu, @Charles Singing lesson',
+        ...          r'2013 Oct 1, Daily standup',
+        ...          r'  :every 1 days',
+        ...          r'  :weekdays',
+        ...          r'2013 Oct 15, Pay day',
+        ...          r'  :monthly',
+        ...          r':first Tue, @Bethany Ipswich'], start)):
+        ...     print(describe_rules(event))
+        every day (weekdays only)
+        first Tue of every month
+        every Thu
+        day 15 of every month
+    """
+    parts = []
+    if event.repeat_yearly:
+        if event.on_Nth_day_of_easter is not None:
+            if event.on_Nth_day_of_easter:
+                parts.append('Easter{:+d} every year'.format(event.on_Nth_day_of_easter))
+            else:
+                parts.append('Easter every year')
+        else:
+            parts.append('{} {} every year'.format(MONTH_NAME[event.date.month],
+                                                   event.date.day))
+    for n in sorted(event.repeat_every_N_days):
+        if n == 1:
+            parts.append('every day')
+        elif n == 7:
+            parts.append('every {}'.format(event.day_name))
+        else:
+            parts.append('every {} days'.format(n))
+    ordinals = ['{} {}'.format(ORDINAL[index], day_name)
+                for index, day_name in sorted(event.repeat_ordinal)]
+    ordinals.extend('day {}'.format(n) for n in sorted(event.repeat_on_Nth_of_month))
+    if ordinals:
+        parts.append('{} of every month'.format(' and '.join(ordinals)))
+    text = ' and '.join(parts) or 'once'
+    if event.weekday_mask == WEEKDAYS_MASK:
+        text += ' (weekdays only)'
+    return text
+
+def summarise_events(events, start, end, at_words=None):
+    """Return a summary row for each event occurring from 'start' to 'end'.
+
+    Rather than working out each date, this uses the closed forms from
+    Event.next_date, Event.previous_date, Event.count_dates and
+    Event.count_excluded, so the cost doesn't depend on how long the
+    date range is.
+
+    Each row is a tuple of (first, last, description, count, excluded,
+    event), sorted by date.
+
+        >>> start = datetime.date(2013, 10, 1)
+        >>> events = parse_lines(
+        ...     [r':every Thu, @Charles Singing lesson',
+        ...      r'  :except 2013 Dec 26',
+        ...      r'2013 Oct 25 Fri, Craft Fair',
+        ...      r'  :for 3 days'], start)
+        >>> for row in summarise_events(events, start, datetime.date(2033, 9, 30)):
+        ...     print(summary_line(*row))
+        every Thu, 2013-10-03 .. 2033-09-29 (1,043 times, 1 exception): @Charles Singing lesson
+        2013-10-25 .. 2013-10-27 (3 days): Craft Fair
+    """
+    rows = []
+    for event in events:
+        if at_words and not at_words.intersection(event.at_words):
+            continue
+        first = event.next_date(start - ONE_DAY)
+        if first is None or first > end:
+            continue
+        last = event.previous_date(end + ONE_DAY)
+        rows.append((first, last, describe_rules(event),
+                     event.count_dates(start, end),
+                     event.count_excluded(start, end), event))
+    rows.sort(key=lambda row: (row[0], row[1], row[5]))
+    return rows
+
+def summary_text(first, last, event):
+    """Return the text of an event occurring from 'first' to 'last'.
+
+    As in the normal report, ':year' is filled in, and so is ':age', unless
+    it changes between 'first' and 'last', in which case it becomes the
+    range of ages.
+
+        >>> event = parse_lines([r'1960* Feb 18, Tibs is :age, born in :year'],
+        ...                     datetime.date(2013, 10, 1)).pop()
+        >>> print(summary_text(datetime.date(2014, 2, 18),
+        ...                    datetime.date(2014, 2, 18), event))
+        Tibs is 54, born in 1960
+        >>> print(summary_text(datetime.date(2014, 2, 18),
+        ...                    datetime.date(2016, 2, 18), event))
+        Tibs is 54..56, born in 1960
+    """
+    if ':age' not in event.colon_words or first.year == last.year:
+        return event.text_for(first)
+    text = event.text.replace(':age', '{}..{}'.format(
+        first.year - event.date.year, last.year - event.date.year))
+    if ':year' in event.colon_words:
+        text = text.replace(':year', str(event.date.year))
+    return text
+
+def summary_line(first, last, description, count, excluded, event):
+    """Return the text for a row from summarise_events.
+    """
+    text = summary_text(first, last, event)
+    if count == 1:
+        return '{}: {}'.format(first, text)
+    if (description == 'every day' and not excluded and
+            count == last.toordinal() - first.toordinal() + 1):
+        # A run of consecutive days
+        return '{} .. {} ({} days): {}'.format(first, last, count, text)
+    counts = '{:,} times'.format(count)
+    if excluded:
+        counts += ', {} exception{}'.format(excluded, '' if excluded == 1 else 's')
+    return '{}, {} .. {} ({}): {}'.format(description, first, last, counts,
+                                          text)
+
+def report_summary(events, start, end, at_words=None, paginate=True):
+    """Report on the events as one line for each, however often they occur.
+    """
+    text = '\n'.join(summary_line(*row)
+                     for row in summarise_events(events, start, end, at_words))
+    if paginate:
+        page(text)
+    else:
+        print(text)
+
 def report_events(things, today, enbolden=True, paginate=True, with_week_number=False):
     """Report on the days given us.
     """
@@ -2118,8 +5637,12 @@ def report_events(things, today, enbolden=True, paginate=True, with_week_number=
     if with_week_number:
         spacer += 3
     spacer_line = ' {}{}'.format(' '*spacer, '-'*(78-spacer))
+    if isinstance(things, OccurrenceTable):
+        things = things.sorted_rows()
+    else:
+        things = sorted(things, key=occurrence_sort_key)
     lines = []
-    for date, text, event in sorted(things):
+    for date, text, event in things:
         iso_year, week_number, weekday = date.isocalendar()
         if prev and week_number != prev:
             lines.append(spacer_line)
@@ -2150,6 +5673,383 @@ def report_events(things, today, enbolden=True, paginate=True, with_week_number=
     else:
         print(text)
 
+# -----------------------------------------------------------------------------
+# Which days have which @<words>
+
+day_expression_re = re.compile(r'\s*(@\w+|&|\||~|!|\(|\)|\band\b|\bor\b|\bnot\b)',
+                               re.IGNORECASE)
+
+def _tokenise(text, token_re, what):
+    """Split 'text' into tokens, as recognised by 'token_re'.
+    """
+    tokens = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        match = token_re.match(text, pos)
+        if not match:
+            raise GiveUp('Unexpected {!r} in {} {!r}'.format(
+                text[pos:].strip(), what, text))
+        tokens.append(match.group(1))
+        pos = match.end()
+    return tokens
+
+def parse_expression(text, token_re, what):
+    """Parse an expression combining terms, and return it as a tuple tree.
+
+    'token_re' recognises the tokens (see _tokenise), and 'what' names the
+    kind of expression, for error messages. The operators are '&' (or
+    'and'), '|' (or 'or') and '~' (or '!' or 'not'), with the usual
+    precedence, and parentheses may be used. An @<word> becomes ('word',
+    <@word>), lowercased, and any other token becomes ('term', <token>),
+    as it was written, so that -days and -where can share one parser and
+    just differ in how they evaluate the result.
+
+        >>> parse_expression('@Alfred & /Tea/', where_expression_re, 'expression')
+        ('and', ('word', '@alfred'), ('term', '/Tea/'))
+    """
+    tokens = _tokenise(text, token_re, what)
+    if not tokens:
+        raise GiveUp('Expected a {}, not {!r}'.format(what, text))
+    operators = [token.lower() for token in tokens]
+
+    def parse_or(pos):
+        left, pos = parse_and(pos)
+        while pos < len(tokens) and operators[pos] in ('|', 'or'):
+            right, pos = parse_and(pos+1)
+            left = ('or', left, right)
+        return left, pos
+
+    def parse_and(pos):
+        left, pos = parse_not(pos)
+        while pos < len(tokens) and operators[pos] in ('&', 'and'):
+            right, pos = parse_not(pos+1)
+            left = ('and', left, right)
+        return left, pos
+
+    def parse_not(pos):
+        if pos >= len(tokens):
+            raise GiveUp('Unexpected end of {} {!r}'.format(what, text))
+        token = operators[pos]
+        if token in ('~', '!', 'not'):
+            operand, pos = parse_not(pos+1)
+            return ('not', operand), pos
+        elif token == '(':
+            inner, pos = parse_or(pos+1)
+            if pos >= len(tokens) or tokens[pos] != ')':
+                raise GiveUp('Missing ")" in {} {!r}'.format(what, text))
+            return inner, pos+1
+        elif token in ('&', 'and', '|', 'or', ')'):
+            raise GiveUp('Unexpected {!r} in {} {!r}'.format(token, what, text))
+        elif token.startswith('@'):
+            return ('word', token), pos+1
+        else:
+            return ('term', tokens[pos]), pos+1
+
+    tree, pos = parse_or(0)
+    if pos != len(tokens):
+        raise GiveUp('Unexpected {!r} in {} {!r}'.format(tokens[pos], what, text))
+    return tree
+
+def parse_day_expression(text):
+    """Parse an expression combining @<words>, and return it as a tuple tree.
+
+        >>> parse_day_expression('@Alfred & ~(@pubhol | @work)')
+        ('and', ('word', '@alfred'), ('not', ('or', ('word', '@pubhol'), ('word', '@work'))))
+    """
+    return parse_expression(text, day_expression_re, 'day expression')
+
+def expression_words(tree):
+    """Return the set of @<words> used in an expression tree.
+    """
+    if tree[0] == 'word':
+        return set([tree[1]])
+    elif tree[0] == 'term':
+        return set()
+    words = set()
+    for operand in tree[1:]:
+        words.update(expression_words(operand))
+    return words
+
+class DayBitsets(object):
+    """For each @<word>, which days from 'start' to 'end' it occurs on.
+
+    Each @<word> has a Python int, with bit N set if the @<word> occurs on
+    the Nth day after 'start'. Combining them for different @<words> is then
+    just a matter of the normal bitwise operators, which deal with a machine
+    word's worth of days at a time.
+
+        >>> start = datetime.date(2013, 10, 1)
+        >>> end = datetime.date(2013, 10, 31)
+        >>> events = parse_lines(
+        ...     [r':every Thu, @Charles Singing lesson',
+        ...      r':first Tue, @Bethany @Charles Ipswich',
+        ...      r':every Tue, @Alfred Python'], start)
+        >>> days = DayBitsets.from_things(find_events(events, start, end), start, end)
+        >>> for date in days.dates(days.evaluate('@alfred & ~@bethany')):
+        ...     print(date)
+        2013-10-08
+        2013-10-15
+        2013-10-22
+        2013-10-29
+    """
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        self.num_days = end.toordinal() - start.toordinal() + 1
+        self.bits = {}
+
+    @classmethod
+    def from_things(cls, things, start, end):
+        """Make the bit sets from (date, text, event) tuples, in one pass.
+        """
+        bitsets = cls(start, end)
+        first = start.toordinal()
+        bits = bitsets.bits
+        for date, text, event in things:
+            bit = 1 << (date.toordinal() - first)
+            for word in event.at_words:
+                bits[word] = bits.get(word, 0) | bit
+        return bitsets
+
+    def all_days(self):
+        """Return the bits for every day from 'start' to 'end'.
+        """
+        return (1 << self.num_days) - 1
+
+    def word(self, word):
+        """Return the bits for the days on which 'word' occurs.
+        """
+        return self.bits.get(word.lower(), 0)
+
+    def evaluate(self, expression):
+        """Return the bits for the days matching 'expression'.
+
+        'expression' may be a string, or a tree from parse_day_expression.
+        """
+        if not isinstance(expression, tuple):
+            expression = parse_day_expression(expression)
+        kind = expression[0]
+        if kind == 'word':
+            return self.word(expression[1])
+        elif kind == 'not':
+            return self.all_days() & ~self.evaluate(expression[1])
+        elif kind == 'and':
+            return self.evaluate(expression[1]) & self.evaluate(expression[2])
+        else:
+            return self.evaluate(expression[1]) | self.evaluate(expression[2])
+
+    def dates(self, bits):
+        """Yield the dates whose bits are set in 'bits'.
+        """
+        first = self.start.toordinal()
+        while bits:
+            lowest = bits & -bits
+            yield datetime.date.fromordinal(first + lowest.bit_length() - 1)
+            bits ^= lowest
+
+def report_days(events, expression, start, end, where=None):
+    """Report on the days that match an expression combining @<words>.
+
+    If 'where' is given, it should be an EventFilter, and only the events
+    (and dates) it allows are looked at.
+    """
+    tree = parse_day_expression(expression)
+    things = find_events(events, start, end, expression_words(tree),
+                         where=where)
+    bitsets = DayBitsets.from_things(things, start, end)
+    count = 0
+    for date in bitsets.dates(bitsets.evaluate(tree)):
+        print(' {:3} {:2} {:3} {:4}'.format(DAYS[date.weekday()], date.day,
+                                            MONTH_NAME[date.month], date.year))
+        count += 1
+    print('{} day{} matching {}'.format(count, '' if count == 1 else 's',
+                                        expression))
+
+# -----------------------------------------------------------------------------
+# Filtering events with -where
+
+where_expression_re = re.compile(r'\s*(@\w+|/(?:[^/\\]|\\.)*/|\w+=[\w,]+|'
+                                 r'&|\||~|!|\(|\)|\band\b|\bor\b|\bnot\b)',
+                                 re.IGNORECASE)
+
+# The actions (named as their switches, without the '-') that honour -where,
+# where 'report' is the normal report
+WHERE_ACTIONS = ('report', 'count', 'conflicts', 'free', 'stats', 'diff',
+                 'since-last', 'export', 'next', 'days')
+
+# The kinds of repetition that 'kind=' can ask for. An event with no
+# repetition at all is 'once'
+EVENT_KINDS = ('once', 'yearly', 'easter', 'every', 'monthly', 'ordinal')
+
+# A "day mask" has a bit for each (month, day of the week) pair, bit
+# 7*(month-1) + weekday, so it can say "Mondays and Fridays in December"
+ALL_DAYS_MASK = (1 << 84) - 1
+
+def _weekday_day_mask(weekday):
+    mask = 0
+    for month in range(12):
+        mask |= 1 << (7*month + weekday)
+    return mask
+
+def _month_day_mask(month):
+    return 0x7F << (7*(month - 1))
+
+def event_kinds(event):
+    """Return the set of the kinds of repetition 'event' uses.
+    """
+    kinds = set(kind for kind, value in event._rules())
+    return kinds or set(['once'])
+
+class EventFilter(object):
+    """A -where expression, compiled into a predicate on events.
+
+    The expression combines any of:
+
+    * @<word> - the event has that @<word>
+    * /<regex>/ - the event text matches that (case insensitive) regular
+      expression
+    * day=<day>[,<day>...] - the event is on one of those days of the week
+    * month=<month>[,<month>...] - the event is in one of those months
+    * kind=<kind>[,<kind>...] - the event repeats in that way, one of
+      'once', 'yearly', 'easter', 'every', 'monthly' or 'ordinal'
+
+    using '&' (or 'and'), '|' (or 'or'), '~' (or '!' or 'not') and
+    parentheses.
+
+    Everything except 'day=' and 'month=' can be decided just by looking
+    at the event, so we do that before working out any of its dates. What
+    is left over becomes a "day mask", saying which days of the week in
+    which months are still wanted, and that is applied a month at a time
+    as the dates are worked out, skipping unwanted months altogether.
+
+        >>> start = datetime.date(2013, 10, 1)
+        >>> events = parse_lines(
+        ...     [r':every Thu, @Charles Singing lesson',
+        ...      r':first Tue, @Bethany @Charles Ipswich',
+        ...      r'2013 Nov 5, Fireworks'], start)
+        >>> where = EventFilter('@charles & ~/singing/ | month=Nov & day=Tue')
+        >>> things = find_events(events, start, datetime.date(2013, 12, 31), where=where)
+        >>> for date, text, event in sorted(things):
+        ...     print(date, text)
+        2013-10-01 @Bethany @Charles Ipswich
+        2013-11-05 @Bethany @Charles Ipswich
+        2013-11-05 Fireworks
+        2013-12-03 @Bethany @Charles Ipswich
+        >>> EventFilter('kind=weekly')
+        Traceback (most recent call last):
+        ...
+        GiveUp: Unrecognised kind 'weekly' in 'kind=weekly', expecting one of once, yearly, easter, every, monthly, ordinal
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.tree = parse_expression(text, where_expression_re, '-where expression')
+        self.day_mask = self._compile(self.tree)
+
+    def _compile(self, tree):
+        """Return a function from an event to a day mask, for an expression tree.
+        """
+        kind = tree[0]
+        if kind == 'word':
+            word = tree[1]
+            return lambda event: ALL_DAYS_MASK if word in event.at_words else 0
+        elif kind == 'term':
+            return self._compile_term(tree[1])
+        elif kind == 'not':
+            operand = self._compile(tree[1])
+            return lambda event: ALL_DAYS_MASK & ~operand(event)
+        left = self._compile(tree[1])
+        right = self._compile(tree[2])
+        if kind == 'and':
+            return lambda event: left(event) & right(event)
+        else:
+            return lambda event: left(event) | right(event)
+
+    def _compile_term(self, token):
+        """Return a function from an event to a day mask, for a single term.
+        """
+        if token.startswith('/'):
+            try:
+                regex = re.compile(token[1:-1], re.IGNORECASE)
+            except re.error as e:
+                raise GiveUp('Bad regular expression {!r} in -where expression:'
+                             ' {}'.format(token, e))
+            return lambda event: ALL_DAYS_MASK if regex.search(event.text) else 0
+
+        name, values = token.split('=', 1)
+        name = name.lower()
+        values = [value for value in values.split(',') if value]
+        if name == 'day':
+            mask = 0
+            for value in values:
+                try:
+                    mask |= _weekday_day_mask(DAYS.index(value.capitalize()))
+                except ValueError:
+                    raise GiveUp('Unrecognised day {!r} in {!r}'.format(value, token))
+            return lambda event: mask
+        elif name == 'month':
+            mask = 0
+            for value in values:
+                try:
+                    mask |= _month_day_mask(MONTH_NUMBER[value.capitalize()])
+                except KeyError:
+                    raise GiveUp('Unrecognised month {!r} in {!r}'.format(value, token))
+            return lambda event: mask
+        elif name == 'kind':
+            kinds = set()
+            for value in values:
+                if value.lower() not in EVENT_KINDS:
+                    raise GiveUp('Unrecognised kind {!r} in {!r}, expecting one'
+                                 ' of {}'.format(value, token, ', '.join(EVENT_KINDS)))
+                kinds.add(value.lower())
+            return lambda event: ALL_DAYS_MASK if kinds & event_kinds(event) else 0
+        else:
+            raise GiveUp('Unrecognised {!r} in -where expression {!r}, expecting'
+                         ' day=, month= or kind='.format(token, self.text))
+
+    @staticmethod
+    def next_date(event, after, mask):
+        """Return the first date after 'after' that 'event' occurs on, and
+        that 'mask' (from day_mask(event)) allows, or None.
+
+        As with Event.next_date, we give up after MAX_SKIPPED_DATES dates
+        that are not wanted, in case the mask never allows any of them.
+        """
+        date = event.next_date(after)
+        if mask == ALL_DAYS_MASK:
+            return date
+        for count in range(MAX_SKIPPED_DATES):
+            if date is None or (mask >> (7*(date.month-1) + date.weekday())) & 1:
+                return date
+            date = event.next_date(date)
+        return None
+
+    def occurrence_dates(self, event, start, end, mask, cache=None):
+        """Return the dates from 'start' to 'end' on which 'event' occurs,
+        limited to those allowed by 'mask' (from self.day_mask(event)).
+        """
+        if cache is None:
+            expand = event.occurrence_dates
+        else:
+            expand = lambda first, last: cache.occurrence_dates(event, first, last)
+        if mask == ALL_DAYS_MASK:
+            return expand(start, end)
+
+        dates = []
+        year, month = start.year, start.month
+        while (year, month) <= (end.year, end.month):
+            weekdays = (mask >> 7*(month - 1)) & 0x7F
+            if weekdays:
+                first = max(start, datetime.date(year, month, 1))
+                last = min(end, datetime.date(year, month,
+                                              calendar.monthrange(year, month)[1]))
+                dates.extend(date for date in expand(first, last)
+                             if (weekdays >> date.weekday()) & 1)
+            year, month = _next_month(year, month)
+        return dates
+
 # -----------------------------------------------------------------------------
 # Bold text - ANSI terminals only
 
@@ -2427,6 +6327,14 @@ def get_cmdline_date(switch, args):
 
 def get_n_month_end(n, today):
     """If asked for 'n' months from today, return the end date
+
+    If that month is too short for today's day of the month, we use its
+    last day instead:
+
+        >>> print(get_n_month_end(18, datetime.date(2013, 8, 31)))
+        2015-02-28
+        >>> print(get_n_month_end(1, datetime.date(2013, 10, 3)))
+        2013-11-03
     """
     if n < 1:
         raise GiveUp('Number of months for "next N months" must be 1 or more,'
@@ -2438,12 +6346,8 @@ def get_n_month_end(n, today):
     while end_month > 12:
         end_month -= 12
         end_year += 1
-    try:
-        end = today.replace(month=end_month, year=end_year)
-    except ValueError:
-        # If we started on Feb 29 and get an invalid date, guess Feb 28
-        end = today.replace(month=end_month, year=end_year, day=today.day-1)
-    return end
+    end_day = min(today.day, calendar.monthrange(end_year, end_month)[1])
+    return datetime.date(end_year, end_month, end_day)
 
 def report(args):
     filename = None
@@ -2456,6 +6360,19 @@ def report(args):
     at_words = set()
     editor = None
     with_week_number = True
+    jobs = 1
+    next_count = None
+    day_expression = None
+    working_hours = (9*60, 17*60)
+    stats_as_json = False
+    diff_filenames = None
+    sqlite_filename = None
+    store_filename = None
+    export_filename = None
+    export_budget = DEFAULT_EXPORT_BUDGET
+    where = None
+    use_index = True
+    index_months = 18
 
     while args:
         word = args.pop(0)
@@ -2506,6 +6423,17 @@ def report(args):
             enbolden = False
         elif word == '-nopage':
             paginate = False
+        elif word == '-index':
+            action = 'index'
+            if args and args[0].isdigit():
+                index_months = int(args.pop(0))
+        elif word == '-noindex':
+            use_index = False
+        elif word == '-jobs':
+            try:
+                jobs = int(args.pop(0))
+            except (IndexError, ValueError):
+                raise GiveUp('Expected a number of processes after {!r}'.format(word))
         elif word in ('-e', '-edit'):
             action = 'edit'
             if args:
@@ -2518,6 +6446,80 @@ def report(args):
                     editor = args.pop(0)
         elif word == '-count':
             action = 'count'
+        elif word == '-conflicts':
+            action = 'conflicts'
+        elif word == '-free':
+            action = 'free'
+        elif word == '-diff':
+            action = 'diff'
+            if len(args) < 2:
+                raise GiveUp('Expected two filenames after {!r}'.format(word))
+            diff_filenames = (args.pop(0), args.pop(0))
+        elif word == '-export-sqlite':
+            action = 'export-sqlite'
+            try:
+                sqlite_filename = args.pop(0)
+            except IndexError:
+                raise GiveUp('Expected a database filename after {!r}'.format(word))
+            if args and args[0].isdigit():
+                index_months = int(args.pop(0))
+        elif word == '-store':
+            action = 'store'
+            try:
+                store_filename = args.pop(0)
+            except IndexError:
+                raise GiveUp('Expected a database filename after {!r}'.format(word))
+            if not is_event_store(store_filename):
+                raise GiveUp('The filename after {!r} should end with one of'
+                             ' {}'.format(word, ', '.join(EVENT_STORE_EXTENSIONS)))
+        elif word == '-export':
+            action = 'export'
+            try:
+                export_filename = args.pop(0)
+            except IndexError:
+                raise GiveUp('Expected a filename (or -) after {!r}'.format(word))
+            if args and args[0].isdigit():
+                export_budget = int(args.pop(0))
+                if export_budget < 1:
+                    raise GiveUp('The number of events for {!r} must be 1'
+                                 ' or more'.format(word))
+        elif word == '-summary':
+            action = 'summary'
+        elif word == '-since-last':
+            action = 'since-last'
+        elif word == '-stats':
+            action = 'stats'
+            if args and args[0] == 'json':
+                stats_as_json = True
+                args.pop(0)
+        elif word == '-hours':
+            try:
+                working_hours = parse_time_span(args.pop(0))
+            except IndexError:
+                working_hours = None
+            if working_hours is None or working_hours[1] > MINUTES_PER_DAY:
+                raise GiveUp('Expected <hh>:<mm>..<hh>:<mm> (within a day)'
+                             ' after {!r}'.format(word))
+        elif word == '-days':
+            action = 'days'
+            try:
+                day_expression = args.pop(0)
+            except IndexError:
+                raise GiveUp('Expected an expression using @<words> after {!r}'.format(word))
+        elif word == '-where':
+            try:
+                where = EventFilter(args.pop(0))
+            except IndexError:
+                raise GiveUp('Expected an expression after {!r}'.format(word))
+        elif word == '-next':
+            action = 'next'
+            try:
+                next_count = int(args.pop(0))
+            except (IndexError, ValueError):
+                raise GiveUp('Expected a number of events after {!r}'.format(word))
+            if next_count < 1:
+                raise GiveUp('The number of events for {!r} must be 1 or more,'
+                             ' not {}'.format(word, next_count))
         elif word in ('-atwords', '-at-words', '-at_words'):
             action = 'atwords'
         elif word == '-cal':
@@ -2585,6 +6587,9 @@ def report(args):
             raise GiveUp('Unexpected argument {!r} (already got'
                          ' filename {!r}'.format(word, filename))
 
+    if where is not None and action not in WHERE_ACTIONS:
+        raise GiveUp('-where cannot be used with -{}'.format(action))
+
     start, yesterday, today, end = determine_dates(start, today, end)
 
     if not filename:
@@ -2596,9 +6601,78 @@ def report(args):
         edit_file(filename, editor)
         return
 
-    print('Reading events from {!r}'.format(filename))
+    if action == 'diff':
+        versions = []
+        for diff_filename in diff_filenames:
+            try:
+                versions.append(read_events(diff_filename, start, end))
+            except GiveUp as e:
+                raise GiveUp('Error reading file {!r}\n{}'.format(diff_filename, e))
+        report_diff(*diff_events(versions[0], versions[1], start, end, where))
+        print('\nstart {} .. yesterday {} .. today {} .. end {}'.format(start,
+            yesterday, today, end))
+        return
+
+    if action == 'index':
+        print('Indexing events from {!r}'.format(filename))
+        try:
+            first, last = build_day_index(filename, today,
+                                          future_months=index_months)
+        except GiveUp as e:
+            raise GiveUp('Error reading file {!r}\n{}'.format(filename, e))
+        print('Wrote {!r}, for {} .. {}'.format(day_index_filename(filename),
+                                                 first, last))
+        return
+
+    if action == 'export-sqlite':
+        # The same dates as the day index would cover
+        first, last = day_index_span(today, future_months=index_months)
+        print('Reading events from {!r}'.format(filename))
+        try:
+            events = read_events(filename, first)
+        except GiveUp as e:
+            raise GiveUp('Error reading file {!r}\n{}'.format(filename, e))
+        added, removed, unchanged = export_sqlite(events, sqlite_filename,
+                                                  first, last)
+        print('Wrote {!r}, for {} .. {}: {} events added, {} removed,'
+              ' {} unchanged'.format(sqlite_filename, first, last, added,
+                                     removed, unchanged))
+        return
+
+    # The day index doesn't remember enough about each event for -where
+    if (action in ('report', 'count', 'conflicts') and use_index and
+            where is None):
+        things = read_day_index(filename, start, end, at_words)
+        if things is not None:
+            print('Reading events from {!r}'.format(day_index_filename(filename)))
+            report_things(action, things, at_words, start, yesterday, today,
+                          end, enbolden, paginate, with_week_number)
+            return
+
+    if action == 'store':
+        # Use a very historical start date, as for -tidy, since the store
+        # may be used for any dates
+        print('Reading events from {!r}'.format(filename))
+        try:
+            events = read_events(filename, datetime.date(1900, 1, 1))
+        except GiveUp as e:
+            raise GiveUp('Error reading file {!r}\n{}'.format(filename, e))
+        store = EventStore(store_filename)
+        try:
+            store.save(events)
+        finally:
+            store.close()
+        print('Wrote {} events to {!r}'.format(len(events), store_filename))
+        return
+
+    if not stats_as_json and export_filename != '-':
+        # Don't spoil the JSON (or the exported events)
+        print('Reading events from {!r}'.format(filename))
     try:
-        events = parse_file(filename, start)
+        if action in ('tidy', 'repr', 'atwords', 'next'):
+            events = read_events(filename, start)
+        else:
+            events = read_events(filename, start, end, at_words)
     except GiveUp as e:
         raise GiveUp('Error reading file {!r}\n{}'.format(filename, e))
 
@@ -2618,8 +6692,101 @@ def report(args):
         report_atwords(events, filename)
         return
 
-    things = find_events(events, start, end, at_words)
+    if action == 'days':
+        report_days(events, day_expression, start, end, where)
+        print('\nstart {} .. yesterday {} .. today {} .. end {}'.format(start,
+            yesterday, today, end))
+        return
+
+    if action == 'export':
+        if export_filename == '-':
+            # Python 2's sys.stdout wants bytes, so write UTF-8 text to
+            # its file descriptor directly
+            sys.stdout.flush()
+            with io.open(sys.stdout.fileno(), 'w', encoding='utf-8',
+                         closefd=False) as fd:
+                count = export_occurrences(events, start, end, fd,
+                                           at_words, where, export_budget)
+        else:
+            with io.open(export_filename, 'w', encoding='utf-8') as fd:
+                count = export_occurrences(events, start, end, fd,
+                                           at_words, where, export_budget)
+            print('Wrote {} events to {!r}, for {} .. {}'.format(count,
+                export_filename, start, end))
+        return
+
+    if action == 'summary':
+        report_summary(events, start, end, at_words, paginate)
+        print('\nstart {} .. yesterday {} .. today {} .. end {}'.format(start,
+            yesterday, today, end))
+        return
+
+    if action == 'since-last':
+        things = find_events(events, start, end, at_words, where=where)
+        seen = SeenOccurrences(seen_filename(filename), at_words, where)
+        new_things = seen.new_things(things)
+        if new_things:
+            report_events(new_things, today, enbolden, paginate,
+                          with_week_number=with_week_number)
+        print('{} new or changed event{} since last time'.format(
+            len(new_things), '' if len(new_things) == 1 else 's'))
+        seen.remember(things, start, end)
+        seen.save()
+        return
+
+    if action == 'stats':
+        report_stats(gather_stats(events, start, end, at_words, where),
+                     stats_as_json, paginate)
+        return
+
+    if action == 'free':
+        if not at_words:
+            raise GiveUp('-free expects at least one @<word> to find free time for')
+        report_free_slots(find_events(events, start, end, at_words, where=where),
+                          at_words, start, end, working_hours)
+        print('\nstart {} .. yesterday {} .. today {} .. end {}'.format(start,
+            yesterday, today, end))
+        return
 
+    if action == 'count' and where is None:
+        # We can count the days without having to work out what they are
+        if not at_words:
+            raise GiveUp('-count expects at least one @<word> to count days for')
+        report_atword_counts(count_atword_days(events, at_words, start, end),
+                             start, end)
+        print('\nstart {} .. yesterday {} .. today {} .. end {}'.format(start,
+            yesterday, today, end))
+        return
+
+    if action == 'next':
+        # We don't know how far ahead we need to look, so just keep taking
+        # the next occurrence until we have enough
+        things = list(itertools.islice(
+            iter_occurrences(events, yesterday, at_words, where), next_count))
+        report_events(things, today, enbolden, paginate,
+                      with_week_number=with_week_number)
+        if things:
+            last = things[-1][0]
+        else:
+            last = today
+        print('\nnext {} event{} .. today {} .. last {}'.format(len(things),
+            '' if len(things) == 1 else 's', today, last))
+        return
+
+    if jobs > 1 and where is None:
+        things = find_events_parallel(events, start, end, at_words,
+                                      max_workers=jobs)
+    else:
+        things = find_events(events, start, end, at_words, where=where,
+                             table=True)
+
+    report_things(action, things, at_words, start, yesterday, today, end,
+                  enbolden, paginate, with_week_number)
+
+def report_things(action, things, at_words, start, yesterday, today, end,
+                  enbolden, paginate, with_week_number):
+    """Produce the report for 'action', given the (date, text, event) tuples.
+    """
     if action == 'count':
         if not at_words:
             raise GiveUp('-count expects at least one @<word> to count days for')
@@ -2629,6 +6796,9 @@ def report(args):
         report_events(things, today, enbolden, paginate,
                       with_week_number=with_week_number)
 
+    elif action == 'conflicts':
+        report_conflicts(things)
+
     print('\nstart {} .. yesterday {} .. today {} .. end {}'.format(start,
         yesterday, today, end))
 